@@ -0,0 +1,19 @@
+import os #operating system support
+
+
+def resize(path, maxwidth): #runs in a worker process of the plugin, makes the image at most maxwidth wide and returns True if it was wider
+    from PIL import Image #pillow, wordcloud depends on it too; imported here so the plugin process never loads it
+
+    with Image.open(path) as image:
+        if (image.width <= maxwidth):
+            return False
+
+        fmt = image.format #thumbnail() makes a new image that has no format
+        height = max(1, int(round(image.height * maxwidth / float(image.width)))) #the same aspect ratio
+        small = image.resize((maxwidth, height), Image.LANCZOS)
+
+    temporary = path + '.resized'
+    small.save(temporary, format=fmt, quality=90)
+    os.replace(temporary, path) #the original stays in place until the smaller one is complete
+
+    return True
@@ -0,0 +1,163 @@
+#lyrics of many songs at once on an asyncio event loop, for --async
+#
+#the searches and song pages are awaited together, at most concurrency of them at a time, and the pages are
+#parsed on their own threads so the loop never waits for BeautifulSoup. The results go through a queue to a
+#single writer coroutine, which stores them on the thread that runs the loop, the one that owns the BatchWriter.
+
+import time #latency of the backends
+import asyncio #the event loop
+import collections #deque of the pending batches
+from concurrent import futures #the blocking calls run on threads
+
+from stats import STATS #counters of --stats
+
+
+class LyricsEngine():
+
+    def __init__(self, resolver, config, log):
+        self._log = log
+
+        config['async'].add({ #default values, overridden by config.yaml
+            'concurrency': 100, #searches and page downloads in flight at the same time, the throttle of each host still applies
+            'parsers': 2, #threads parsing song pages
+        })
+
+        self.resolver = resolver #the backends and their statistics, the order of the lyric option
+        self.concurrency = max(1, config['async']['concurrency'].get(int))
+
+        #the requests of the session block, so the async client runs them on a thread each; the session
+        #keeps its cache, throttle, retries and circuit breaker without a second implementation of them
+        self.io = futures.ThreadPoolExecutor(max_workers=self.concurrency)
+        self.parsers = futures.ThreadPoolExecutor(max_workers=max(1, config['async']['parsers'].get(int)))
+
+        self.loop = asyncio.new_event_loop()
+        self.slots = asyncio.Semaphore(self.concurrency)
+        self.queue = asyncio.Queue() #(songs, results, API calls, future) for the writer
+
+    async def request(self, function, *args): #one blocking call of the session, awaited
+        async with self.slots:
+            return await self.loop.run_in_executor(self.io, function, *args)
+
+    async def parse(self, function, html):
+        return await self.loop.run_in_executor(self.parsers, function, html)
+
+    async def fetchbackend(self, name, artist, title): #one backend, recorded like LyricsResolver.call
+        backend = self.resolver.backends[name]
+        start = time.perf_counter()
+
+        try:
+            if (hasattr(backend, 'songurl')): #the search, the page and the parsing are separate steps
+                url = await self.request(backend.songurl, artist, title)
+                html = await self.request(backend.get_url, url) if url else None
+                lyrics = await self.parse(backend.scrapelyrics, html) if html else None
+            else:
+                lyrics = await self.request(backend.fetch, artist, title)
+        except Exception:
+            self.resolver.record(name, time.perf_counter() - start, False, True)
+            raise
+
+        self.resolver.record(name, time.perf_counter() - start, bool(lyrics), False)
+        return lyrics
+
+    async def fetch(self, artist, title): #like LyricsResolver.fetch, without hedging: the songs are already asked at the same time
+        import requests
+
+        error = None
+        for name in self.resolver.order():
+            try:
+                lyrics = await self.fetchbackend(name, artist, title)
+            except requests.RequestException as exc: #the next backend may have them
+                self._log.debug('{0} failed: {1}', name, exc)
+                error = exc
+                continue
+            if (lyrics):
+                return lyrics
+
+        if (error is not None):
+            raise error
+        return None
+
+    async def fetchsongs(self, songs, byalbum): #like lyricsworker.fetch: ([(lyrics, error)], API calls made)
+        import requests
+
+        name, backend = self.resolver.first()
+        if (byalbum and len(songs) > 1 and hasattr(backend, 'fetchalbum')):
+            try:
+                lyrics, calls = await self.request(self.resolver.call, name, 'fetchalbum', songs[0][0], [title for artist, title in songs])
+                return [(text, None) for text in lyrics], calls
+            except requests.RequestException as exc: #not a miss, the songs are tried again in the next run
+                return [(None, str(exc))] * len(songs), 0
+
+        async def one(artist, title):
+            try:
+                return await self.fetch(artist, title), None
+            except requests.RequestException as exc:
+                return None, str(exc)
+
+        results = await asyncio.gather(*[one(artist, title) for artist, title in songs])
+        return list(results), len(songs)
+
+    async def job(self, todo, byalbum, done): #fetches the songs of one batch and hands them to the writer
+        try:
+            results, calls = await self.fetchsongs([(item.artist, item.title) for item in todo], byalbum)
+        except Exception as exc: #raised by wait() on the main thread
+            done.set_exception(exc)
+            return
+        await self.queue.put((todo, results, calls, done))
+
+    async def writer(self, store): #the single writer, store(items, results, calls) runs here one batch at a time
+        while (True):
+            job = await self.queue.get()
+            if (job is None):
+                return
+
+            todo, results, calls, done = job
+            try:
+                store(todo, results, calls)
+            except Exception as exc:
+                done.set_exception(exc)
+            else:
+                done.set_result(None)
+
+    def run(self, batches, needs, store, byalbum): #yields the batches in order once their lyrics are stored; needs(item) tells which items to fetch
+        pending = collections.deque() #(batch, future set by the writer), at most 2 * concurrency of them
+        tasks = set()
+        writer = self.loop.create_task(self.writer(store))
+
+        try:
+            for batch in batches:
+                todo = [item for item in batch if needs(item)] #the database is read only here
+                done = None
+                if (todo):
+                    done = self.loop.create_future()
+                    task = self.loop.create_task(self.job(todo, byalbum, done)) #starts with the next wait, together with the others
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                pending.append((batch, done))
+
+                if (len(pending) >= 2 * self.concurrency): #enough songs to keep every slot busy, the memory stays bounded
+                    yield self.wait(*pending.popleft())
+
+            while (pending):
+                yield self.wait(*pending.popleft())
+
+            self.loop.run_until_complete(self.queue.put(None))
+            self.loop.run_until_complete(writer)
+        finally:
+            self.close(list(tasks) + [writer])
+
+    def wait(self, batch, done): #runs the loop until the writer has stored this batch, the other batches go on meanwhile
+        if (done is not None):
+            with STATS.timer('stage.lyrics'):
+                self.loop.run_until_complete(done)
+        return batch
+
+    def close(self, tasks): #an interrupted run cancels the songs in flight, the stored ones stay
+        for task in tasks:
+            task.cancel()
+        if (tasks):
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+
+        self.io.shutdown(wait=False, cancel_futures=True)
+        self.parsers.shutdown(wait=False, cancel_futures=True)
+        self.loop.close()
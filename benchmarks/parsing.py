@@ -0,0 +1,75 @@
+#micro-benchmark of Genius.scrapelyrics: the fast parser against the full parser on saved song pages
+#
+#    python benchmarks/parsing.py [--repeat 50] [page.html ...]
+#
+#without arguments the pages in fixtures/ are used. The output of both parsers is compared for every
+#page, a difference is an error. The results are printed as JSON.
+
+import os #operating system support
+import sys #the plugin modules are imported from the parent directory
+import glob #fixture pages
+import json #JavaScript Object Notation
+import time #timers
+import logging #Genius needs a logger
+import argparse #command line options
+from string import Template #the fixtures have $title and $artist placeholders
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(ROOT))
+
+from beets import config
+
+
+def best(function, page, repeat): #the fastest of repeat runs, in milliseconds
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        function(page)
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='fast against full lyrics parsing')
+    parser.add_argument('pages', nargs='*', help='saved Genius song pages, fixtures/*.html by default')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    config.read(user=False, defaults=True)
+    config['metadata_retriever']['genius_api_key'] = 'benchmark'
+
+    import getlyrics
+    genius = getlyrics.Genius(config['metadata_retriever'], logging.getLogger('benchmark'))
+
+    pages = args.pages or sorted(glob.glob(os.path.join(ROOT, 'fixtures', '*.html')))
+    results = {}
+    failed = False
+
+    for path in pages:
+        with open(path, encoding='utf-8', newline='') as f: #newline='' keeps \r and \r\n as they are on the wire
+            page = Template(f.read()).safe_substitute(title='Song Title', artist='Artist Name')
+
+        full = genius.parselyrics(page)
+        fast = genius.fastlyrics(page)
+        identical = fast is None or fast == full #None means scrapelyrics falls back to the full parser
+        failed = failed or not identical
+
+        fulltime = best(genius.parselyrics, page, args.repeat)
+        fasttime = best(genius.scrapelyrics, page, args.repeat) #what the plugin runs, including the fallback
+
+        results[os.path.basename(path)] = {
+            'bytes': len(page.encode('utf-8')),
+            'fast_path': fast is not None,
+            'identical': identical,
+            'full_ms': round(fulltime, 3),
+            'fast_ms': round(fasttime, 3),
+            'speedup': round(fulltime / fasttime, 2) if fasttime else None,
+        }
+
+    print(json.dumps(results, indent=2, sort_keys=True))
+    if (failed):
+        sys.exit('the fast parser and the full parser disagree')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+#offline benchmark of the metadata_retriever command paths
+#
+#    python benchmarks/run.py --albums 200 --tracks 10 --latency 0.02 --output results.json
+#
+#a synthetic beets library is built in a temporary directory and the plugin is pointed at the
+#local stand-in servers of stubserver.py, so nothing leaves the machine. The results are printed
+#as JSON: throughput, p50/p99 latency of each album or item and peak memory for every path.
+
+import os #operating system support
+import sys #the plugin modules are imported from the parent directory
+import io #the command prints its help text, it is thrown away
+import json #JavaScript Object Notation
+import time #timers
+import shutil #the temporary directory is removed at the end
+import argparse #command line options
+import tempfile #the library and the downloaded files live in a temporary directory
+import platform #python version for the results
+import tracemalloc #peak memory of each path
+import contextlib #redirect_stdout
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import beets #version for the results
+from beets import config, library
+
+import stubserver
+from stubserver import StubServer
+
+
+PATHS = { #command line options of each path, and the method whose calls are timed
+    'cover': (['-c'], 'fetchcover'),
+    'lyrics': (['-l'], 'getlyrics'),
+    'lyrics-album': (['-l', '-b'], 'getalbumlyrics'),
+    'allreleases': (['-a'], 'allreleases'),
+    'write': (['-w'], 'writetofile'),
+}
+
+
+def buildlibrary(directory, albums, tracks, lyrics=False): #N albums of M items, named like the answers of the stand-in servers
+    lib = library.Library(os.path.join(directory, 'library.db'), os.path.join(directory, 'music'))
+
+    with lib.transaction():
+        for a in range(albums):
+            albumdir = os.path.join(directory, 'music', stubserver.artist_name(a), stubserver.album_name(a))
+            os.makedirs(albumdir)
+
+            items = []
+            for t in range(tracks):
+                title = stubserver.song_title(a, t)
+                items.append(library.Item(
+                    path=os.path.join(albumdir, '{0:02d} {1}.mp3'.format(t + 1, title)).encode('utf-8'),
+                    title=title, track=t + 1,
+                    artist=stubserver.artist_name(a), albumartist=stubserver.artist_name(a),
+                    album=stubserver.album_name(a),
+                    mb_albumid=stubserver.album_mbid(a), mb_releasegroupid=stubserver.releasegroup_mbid(a),
+                    lyrics='night light road home\nheart fire rain river' if lyrics else '',
+                ))
+            lib.add_album(items)
+
+    return lib
+
+
+def configure(directory, stub, args): #beets configuration of a run, the plugin talks only to the stand-in servers
+    config.clear()
+    config.read(user=False, defaults=True)
+    config['directory'] = os.path.join(directory, 'music')
+
+    plugin = config['metadata_retriever']
+    plugin['genius_api_key'] = 'benchmark'
+    plugin['genius_url'] = stub.url
+    plugin['auto'] = False
+    plugin['workers'] = args.workers
+    plugin['cache']['enabled'] = args.cache
+    plugin['cache']['path'] = os.path.join(directory, 'cache.db')
+    plugin['queue']['path'] = os.path.join(directory, 'queue.db')
+    plugin['download']['journal'] = os.path.join(directory, 'downloads.db')
+    plugin['wordclouds']['path'] = os.path.join(directory, 'words.db')
+    plugin['search']['path'] = os.path.join(directory, 'lyrics.db')
+    plugin['throttle']['rate'] = args.rate #the stand-in servers are not throttled, the limiter should not be what is measured
+    plugin['throttle']['burst'] = args.rate
+    plugin['throttle']['max_rate'] = args.rate
+    plugin['throttle']['backoff'] = 0.05
+
+    import musicbrainzngs
+    import coverart
+
+    coverart.CoverArtArchive.URL = stub.url + '/release/{mbid}/front'
+    musicbrainzngs.set_hostname(stub.host)
+    musicbrainzngs.set_rate_limit(False) #the stand-in server does not need the 1 request per second of musicbrainz.org
+
+
+def percentile(values, q):
+    if (not values):
+        return None
+    values = sorted(values)
+    return values[int(round(q * (len(values) - 1)))]
+
+
+def runpath(name, args):
+    options, timed = PATHS[name]
+    directory = tempfile.mkdtemp(prefix='mr-bench-')
+    stub = StubServer(args.albums, args.tracks, releases=args.releases,
+                      latency=args.latency, error_rate=args.error_rate, seed=args.seed).start()
+
+    try:
+        configure(directory, stub, args)
+        lib = buildlibrary(directory, args.albums, args.tracks, lyrics=(name == 'write'))
+
+        import metadata_retriever
+        plugin = metadata_retriever.metadata_retriever()
+        command = plugin.commands()[0]
+        opts, rest = command.parser.parse_args(options)
+
+        latencies = []
+        method = getattr(plugin, timed)
+
+        def timedcall(*a, **kw): #replaces the method on the instance, the plugin looks it up there
+            start = time.perf_counter()
+            try:
+                return method(*a, **kw)
+            finally:
+                latencies.append(time.perf_counter() - start)
+
+        setattr(plugin, timed, timedcall)
+
+        if (args.memory):
+            tracemalloc.start()
+
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            command.func(lib, opts, rest)
+        seconds = time.perf_counter() - start
+
+        peak = None
+        if (args.memory):
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        plugin.session.close()
+        units = args.albums if name in ('cover', 'allreleases') else args.albums * args.tracks
+
+        return {
+            'units': units, #albums or items processed
+            'seconds': round(seconds, 4),
+            'throughput': round(units / seconds, 2) if seconds else None, #albums or items per second
+            'calls': len(latencies),
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 3) if latencies else None,
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+            'peak_mb': round(peak / 1024.0 / 1024.0, 3) if peak is not None else None,
+            'requests': dict(stub.counts),
+        }
+    finally:
+        stub.stop()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='offline benchmark of the metadata_retriever command paths')
+    parser.add_argument('--albums', type=int, default=50)
+    parser.add_argument('--tracks', type=int, default=10, help='items in each album')
+    parser.add_argument('--releases', type=int, default=3, help='releases in each release group, for allreleases')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every answer of the stand-in servers')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='part of the answers that are 503 errors')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the error rate')
+    parser.add_argument('--rate', type=float, default=10000.0, help='requests per second allowed for each host by the limiter')
+    parser.add_argument('--workers', type=int, default=4, help='metadata_retriever workers option')
+    parser.add_argument('--cache', action='store_true', help='leave the response cache on')
+    parser.add_argument('--no-memory', dest='memory', action='store_false', help='do not trace the peak memory, it slows the run down')
+    parser.add_argument('--paths', default='cover,lyrics,allreleases', help='comma separated, any of ' + ','.join(sorted(PATHS)))
+    parser.add_argument('--output', help='also write the results to this file')
+    args = parser.parse_args()
+
+    results = {
+        'meta': {
+            'albums': args.albums, 'tracks': args.tracks, 'releases': args.releases,
+            'latency': args.latency, 'error_rate': args.error_rate, 'workers': args.workers,
+            'cache': args.cache, 'python': platform.python_version(), 'beets': beets.__version__,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': {},
+    }
+
+    for name in args.paths.split(','):
+        results['results'][name] = runpath(name.strip(), args)
+
+    text = json.dumps(results, indent=2, sort_keys=True)
+    print(text)
+
+    if (args.output):
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
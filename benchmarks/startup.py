@@ -0,0 +1,89 @@
+#startup cost of the plugin: what enabling metadata_retriever adds to every beet command, even "beet ls"
+#
+#    python benchmarks/startup.py [--runs 10] [--max-ms 50] [--output startup.json]
+#
+#each run is a fresh interpreter that imports beets, then imports and constructs the plugin. The
+#results are printed as JSON: the import time of beets, the time the plugin adds, the peak RSS and
+#the heavy modules the plugin loaded. A heavy module or a plugin time above --max-ms is an error.
+
+import os #operating system support
+import sys #the child interpreters use the same python
+import json #JavaScript Object Notation
+import argparse #command line options
+import subprocess #every run starts a new interpreter, nothing is imported yet
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY = ['requests', 'bs4', 'wordcloud', 'numpy', 'PIL', 'matplotlib'] #only the stages that use them may import them
+
+CHILD = '''
+import sys, time, json, resource
+sys.path.insert(0, {root!r})
+
+start = time.perf_counter()
+from beets import config, library, ui
+import beets.plugins
+config.read(user=False, defaults=True)
+config['metadata_retriever']['genius_api_key'] = 'benchmark'
+loaded = set(sys.modules)
+beets_done = time.perf_counter()
+
+import metadata_retriever
+plugin = metadata_retriever.metadata_retriever()
+plugin.commands()
+done = time.perf_counter()
+
+print(json.dumps({{
+    'beets_ms': (beets_done - start) * 1000,
+    'plugin_ms': (done - beets_done) * 1000,
+    'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+    'modules': sorted(name for name in set(sys.modules) - loaded if '.' not in name),
+}}))
+'''
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='startup cost of the metadata_retriever plugin')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--max-ms', type=float, help='fail if the plugin adds more than this')
+    parser.add_argument('--output', help='also write the results to this file')
+    args = parser.parse_args()
+
+    runs = []
+    for i in range(args.runs):
+        output = subprocess.check_output([sys.executable, '-c', CHILD.format(root=ROOT)], cwd=ROOT)
+        runs.append(json.loads(output.decode('utf-8').strip().splitlines()[-1]))
+
+    modules = runs[0]['modules']
+    heavy = sorted(name for name in HEAVY if name in modules)
+
+    results = {
+        'runs': args.runs,
+        'python': sys.version.split()[0],
+        'beets_ms': round(median([run['beets_ms'] for run in runs]), 2), #median of the runs
+        'plugin_ms': round(median([run['plugin_ms'] for run in runs]), 2),
+        'rss_mb': round(median([run['rss_mb'] for run in runs]), 2),
+        'modules': modules, #top level modules the plugin added
+        'heavy': heavy,
+    }
+
+    text = json.dumps(results, indent=2, sort_keys=True)
+    print(text)
+
+    if (args.output):
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+
+    if (heavy):
+        sys.exit('the plugin imports {0} at startup'.format(', '.join(heavy)))
+    if (args.max_ms is not None and results['plugin_ms'] > args.max_ms):
+        sys.exit('the plugin adds {0}ms to the startup, more than {1}ms'.format(results['plugin_ms'], args.max_ms))
+
+
+if __name__ == '__main__':
+    main()
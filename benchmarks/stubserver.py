@@ -0,0 +1,209 @@
+#local stand-in for coverartarchive.org, api.genius.com, genius.com and musicbrainz.org
+#every answer is made from the files in fixtures/ and the names of the synthetic library built by run.py
+
+import os #operating system support
+import re #regular expressions
+import json #JavaScript Object Notation
+import time #latency of the answers
+import random #error rate of the answers
+import threading #the server answers on a background thread
+import collections #request counters
+from string import Template #placeholders of the fixtures are $names, so braces in the HTML and JSON stay as they are
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from urllib.parse import urlsplit, parse_qs
+
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def fixture(name, mode='r'):
+    with open(os.path.join(FIXTURES, name), mode) as f:
+        return f.read()
+
+
+#names of the synthetic library, run.py uses the same functions when it builds the library
+
+def artist_name(album):
+    return 'Artist {0:04d}'.format(album % Layout.artists)
+
+def album_name(album):
+    return 'Album {0:05d}'.format(album)
+
+def song_title(album, track):
+    return 'Song {0:05d}-{1:02d}'.format(album, track)
+
+def album_mbid(album):
+    return 'rel-{0:05d}-0'.format(album)
+
+def releasegroup_mbid(album):
+    return 'rg-{0:05d}'.format(album)
+
+
+class Layout(): #shape of the synthetic library, set by StubServer
+    albums = 0
+    tracks = 0
+    artists = 1
+    releases = 1 #releases in each release group
+
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1' #keep-alive, so the connection pools of the plugin make a difference
+
+    def log_message(self, format, *args): #quiet
+        pass
+
+    def do_GET(self):
+        stub = self.server.stub
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode('utf-8') if length else '' #Genius.search sends its query in the body
+
+        url = urlsplit(self.path)
+        params = parse_qs(url.query)
+        params.update(parse_qs(body))
+
+        route, answer = self.route(url.path, params)
+        stub.count(route)
+
+        if (stub.latency):
+            time.sleep(stub.latency)
+
+        if (answer is None):
+            return self.answer(404, b'not found', 'text/plain')
+        if (stub.fail()):
+            return self.answer(503, b'try again', 'text/plain', {'Retry-After': '1'})
+
+        content, content_type = answer
+        self.answer(200, content, content_type)
+
+    def answer(self, status, content, content_type, headers=None):
+        self.server.stub.count('bytes', len(content))
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def route(self, path, params):
+        stub = self.server.stub
+
+        match = re.match(r'^/release/([^/]+)/front(-\d+)?$', path)
+        if (match):
+            return 'coverart', (stub.cover, 'image/jpeg')
+
+        if (path == '/search'):
+            query = ' '.join(params.get('q', ['']))
+            return 'genius-search', self.search(query)
+
+        match = re.match(r'^/artists/(\d+)/songs$', path)
+        if (match):
+            page = int(params.get('page', ['1'])[0])
+            per_page = int(params.get('per_page', ['20'])[0])
+            return 'genius-artist-songs', self.artistsongs(int(match.group(1)), page, per_page)
+
+        match = re.match(r'^/lyrics/song-(\d+)-(\d+)$', path)
+        if (match):
+            album, track = int(match.group(1)), int(match.group(2))
+            page = stub.song.substitute(title=song_title(album, track), artist=artist_name(album))
+            return 'genius-page', (page.encode('utf-8'), 'text/html; charset=utf-8')
+
+        match = re.match(r'^/ws/2/release-group/rg-(\d+)$', path)
+        if (match):
+            return 'musicbrainz', self.releasegroup(int(match.group(1)))
+
+        return 'unknown', None
+
+    def song(self, album, track): #song object of the Genius API
+        return {
+            'id': album * 100 + track,
+            'title': song_title(album, track),
+            'url': '{0}/lyrics/song-{1:05d}-{2:02d}'.format(self.server.stub.url, album, track),
+            'primary_artist': {'id': 1000 + album % Layout.artists, 'name': artist_name(album)},
+        }
+
+    def search(self, query):
+        match = re.search(r'song (\d+)-(\d+)', query, re.IGNORECASE)
+        if (not match):
+            return json.dumps({'meta': {'status': 200}, 'response': {'hits': []}}).encode('utf-8'), 'application/json'
+
+        album, track = int(match.group(1)), int(match.group(2))
+        song = self.song(album, track)
+        content = self.server.stub.search.substitute(
+            title=song['title'], artist=song['primary_artist']['name'],
+            song_id=song['id'], song_url=song['url'], song_path='/lyrics/song-{0:05d}-{1:02d}'.format(album, track),
+            artist_id=song['primary_artist']['id'], artist_url=self.server.stub.url + '/artists/x',
+        )
+        return content.encode('utf-8'), 'application/json'
+
+    def artistsongs(self, artist_id, page, per_page):
+        songs = [self.song(album, track)
+                 for album in range(artist_id - 1000, Layout.albums, Layout.artists)
+                 for track in range(Layout.tracks)]
+        start = (page - 1) * per_page
+        content = {'meta': {'status': 200}, 'response': {
+            'songs': songs[start:start + per_page],
+            'next_page': page + 1 if start + per_page < len(songs) else None,
+        }}
+        return json.dumps(content).encode('utf-8'), 'application/json'
+
+    def releasegroup(self, album):
+        releases = ''.join('<release id="rel-{0:05d}-{1}"><title>{2}</title></release>'.format(album, i, album_name(album))
+                           for i in range(Layout.releases))
+        content = self.server.stub.releasegroup.substitute(
+            releasegroup_id=releasegroup_mbid(album), album=album_name(album),
+            count=Layout.releases, releases=releases,
+        )
+        return content.encode('utf-8'), 'application/xml; charset=utf-8'
+
+
+class StubServer(): #starts the server on a free local port
+
+    def __init__(self, albums, tracks, artists=None, releases=3, latency=0.0, error_rate=0.0, seed=0):
+        Layout.albums = albums
+        Layout.tracks = tracks
+        Layout.artists = max(1, artists or albums // 4)
+        Layout.releases = releases
+
+        self.latency = latency #seconds added to every answer
+        self.error_rate = error_rate #part of the answers that are 503 errors
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = collections.Counter()
+
+        self.cover = fixture('cover.jpg', 'rb')
+        self.song = Template(fixture('genius_song.html'))
+        self.search = Template(fixture('genius_search.json'))
+        self.releasegroup = Template(fixture('release_group.xml'))
+
+        self.server = ThreadingServer(('127.0.0.1', 0), Handler)
+        self.server.stub = self
+        self.host = '127.0.0.1:{0}'.format(self.server.server_address[1])
+        self.url = 'http://' + self.host
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+
+    def count(self, key, n=1):
+        with self.lock:
+            self.counts[key] += n
+
+    def fail(self):
+        with self.lock:
+            return self.random.random() < self.error_rate
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -1,26 +1,19 @@
-from beets import plugins #enables to use the plugins that already exists
-from beets import ui #command operations are defined under this library
 from beets import util #utilization library
-from beets import config #to be able to edit the configuration file of the application
-from beets.plugins import BeetsPlugin #importing beets plugin packet to be able to write a new plugin
 
 import os #operating system support
-import re #regular expressions 
 
-import requests #this library allows to make requests like get, post, etc. 
-from bs4 import BeautifulSoup #BeautifulSoup will be used for fetching lyrics
-
-import warnings #for warning control
-import html #This module defines functions to manipulate HTML.
-import json #JavaScript Object Notation 
+from httpsession import HTTPSession #connection pool shared by all backends
+from download import Downloader #atomic, resumable downloads
 
 
 class CoverArtArchive(): #this is the main website used in the project to get images 
 
-    def __init__(self, log, config, match_by=None): #constructor
+    def __init__(self, log, config, match_by=None, session=None): #constructor
         self._log = log
         self._config = config
         self.match_by = match_by  
+        self.session = session or HTTPSession(config, log) #the plugin passes its shared session
+        self.downloader = Downloader(config, log, self.session)
 
     Type = ['release'] 
 
@@ -29,29 +22,41 @@ class CoverArtArchive(): #this is the main website used in the project to get im
     else:
         URL = 'http://coverartarchive.org/release/{mbid}/front'
 
-    def get(self, album, plugin, paths): 
-        if (album.mb_albumid): #Return the Cover Art Archive URLs using album MusicBrainz release ID.
-            save_path = '/Users/dilanuslan/Desktop/NewMusic/'  #the constant part of the path
-            save_path = save_path + album.albumartist + '/' + album.album #the artist name and the album name is added to the path 
-            filename = "cover.jpg"  
+    THUMBNAILS = [250, 500, 1200] #widths of the thumbnails the archive makes of every image, URL + '-250'
+
+    def thumbnail(self): #smallest thumbnail that is at least maxwidth wide, None means the original
+        maxwidth = self._config['maxwidth'].get(int)
+
+        if (not maxwidth or self._config['high_resolution'].get(bool)): #the original is asked for, it is resized locally if needed
+            return None
 
-            finalname = os.path.join(save_path, filename) #adding filename to the path
+        for width in self.THUMBNAILS:
+            if (width >= maxwidth):
+                return width
 
-            pic_url = self.URL.format(mbid=album.mb_albumid)
+        return None #wider than the largest thumbnail
 
-            with open(finalname, 'wb') as cover:
-                response = requests.get(pic_url, stream=True)
+    def urls(self, mbid): #the thumbnail first, then the original for the images that have no thumbnail of that size
+        original = self.URL.format(mbid=mbid)
+        width = self.thumbnail()
 
-                if not response.ok:
-                    print("Image not found...")
+        if (width is None):
+            return [original]
+        return ['{0}-{1}'.format(original, width), original]
 
-                for block in response.iter_content(1024):
-                    if not block:
-                        break
+    def get(self, album, plugin, paths): #returns the path of the downloaded cover, None if the archive has no cover for the album, network errors are raised
+        if (not album.mb_albumid): #Return the Cover Art Archive URLs using album MusicBrainz release ID.
+            return None
 
-                    cover.write(block)
+        save_path = util.py3_path(paths[0]) #the directory of the album, paths[0] is album.path
+        filename = "cover.jpg"  
 
-        return save_path
+        finalname = os.path.join(save_path, filename) #adding filename to the path
+
+        if (self.downloader.fetch(self.urls(album.mb_albumid), finalname, validate=isimage) is None): #the file is created only when there is an image to write
+            return None
+
+        return finalname
 
 SOURCE = ['coverart'] #album covers are taken from coverartarchive.org
 
@@ -62,4 +67,20 @@ ART_SOURCE = {
 IMAGE_TYPES = { #the retrieved images should be in these formats
     'image/jpeg': [b'jpg', b'jpeg'], #b indicates byte literals
     'image/png': [b'png']
-}
\ No newline at end of file
+}
+
+MAGIC = { #first bytes of the files of each type in IMAGE_TYPES
+    b'\xff\xd8\xff': 'image/jpeg',
+    b'\x89PNG\r\n\x1a\n': 'image/png',
+}
+
+
+def imagetype(head): #content type of a file from its first bytes, None if it is not one of IMAGE_TYPES
+    for magic, content_type in MAGIC.items():
+        if (head.startswith(magic) and content_type in IMAGE_TYPES):
+            return content_type
+    return None
+
+
+def isimage(head):
+    return imagetype(head) is not None
@@ -0,0 +1,38 @@
+from stats import STATS #counters of --stats
+
+
+class BatchWriter(): #collects the albums and items to store and writes them in one transaction per batch
+
+    def __init__(self, lib, size, log):
+        self._log = log
+        self.lib = lib
+        self.size = max(1, size) #objects per transaction
+        self.pending = []
+
+    def store(self, obj): #replaces obj.store()
+        self.pending.append(obj)
+        if (len(self.pending) >= self.size):
+            self.flush()
+
+    def flush(self):
+        if (not self.pending):
+            return
+
+        pending, self.pending = self.pending, []
+        with STATS.timer('store'), self.lib.transaction(): #one commit for the whole batch, the nested transactions of store() join it
+            for obj in pending:
+                obj.store()
+        STATS.count('stored', len(pending))
+
+        self._log.debug('stored {0} changes in one transaction', len(pending))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback): #the buffered changes are written even when the run is interrupted with Ctrl-C
+        try:
+            self.flush()
+        except Exception as exc:
+            if (exc_type is None):
+                raise
+            self._log.error('could not store the last changes: {0}', exc) #the first exception is more important
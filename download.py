@@ -0,0 +1,128 @@
+import os #operating system support
+import time #the time a download was started
+import hashlib #the content is hashed while it streams
+
+from sidestore import SideStore #the journal survives between runs, so it is kept in a small SQLite database
+from stats import STATS #counters of --stats
+
+
+class DownloadJournal(SideStore): #unfinished downloads: the final path, the url and the validator of the partial file next to it
+
+    def __init__(self, path=''): #keyed by file paths, so all libraries share it
+        super(DownloadJournal, self).__init__('downloads', [
+            'CREATE TABLE IF NOT EXISTS downloads (path TEXT PRIMARY KEY, url TEXT, validator TEXT, started REAL)',
+        ], path)
+
+    def get(self, path): #(url, validator) or None
+        with self._lock:
+            return self.connection().execute('SELECT url, validator FROM downloads WHERE path = ?', (path,)).fetchone()
+
+    def start(self, path, url, validator):
+        with self._lock:
+            db = self.connection()
+            db.execute('INSERT OR REPLACE INTO downloads VALUES (?, ?, ?, ?)', (path, url, validator, time.time()))
+            db.commit()
+
+    def done(self, path):
+        with self._lock:
+            db = self.connection()
+            db.execute('DELETE FROM downloads WHERE path = ?', (path,))
+            db.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self.connection().execute('SELECT COUNT(*) FROM downloads').fetchone()[0]
+
+
+class Downloader(): #streams a file to path.part, checks it and renames it to path, so path is never half written
+
+    def __init__(self, config, log, session):
+        self._log = log
+        self.session = session
+
+        config['download'].add({ #default values, overridden by config.yaml
+            'chunk_size': 256 * 1024, #bytes read from the connection at a time
+            'resume': True, #continue partial files of interrupted runs with HTTP Range requests
+            'journal': '', #empty means metadata_retriever_downloads.db in the beets configuration directory
+        })
+
+        download = config['download']
+        self.chunk_size = max(1024, download['chunk_size'].get(int))
+        self.resume = download['resume'].get(bool)
+        self.journal = DownloadJournal(download['journal'].as_filename() if download['journal'].get() else '')
+
+    def fetch(self, urls, path, validate=None): #tries the urls in order, returns the sha1 of the file, None when no url has it (404), other error statuses are raised; validate(first bytes) rejects wrong content
+        part = path + '.part'
+
+        for url in urls:
+            response, offset = self.request(url, path, part)
+            if (response is not None):
+                break
+        else:
+            return None
+
+        digest = hashlib.sha1()
+        if (offset):
+            with open(part, 'rb') as f: #the hash covers the bytes of the earlier run too
+                for block in iter(lambda: f.read(self.chunk_size), b''):
+                    digest.update(block)
+
+        validator = response.headers.get('ETag') or response.headers.get('Last-Modified')
+        self.journal.start(path, url, validator) #an interruption from here on leaves a partial file that the next run continues
+
+        with open(part, 'ab' if offset else 'wb') as f:
+            for block in response.iter_content(self.chunk_size):
+                if not block:
+                    break
+
+                digest.update(block)
+                f.write(block)
+
+        with open(part, 'rb') as f:
+            head = f.read(16)
+
+        if (validate and not validate(head)): #an error page or a truncated file is never renamed in place
+            self._log.debug('not an image: {0}', url)
+            STATS.count('download.invalid')
+            os.remove(part)
+            self.journal.done(path)
+            return None
+
+        os.replace(part, path) #atomic on the same file system
+        self.journal.done(path)
+
+        return digest.hexdigest()
+
+    def request(self, url, path, part): #(response, bytes already on the disk), (None, 0) when the server has nothing; other errors are raised
+        offset = 0
+        headers = {}
+
+        entry = self.journal.get(path) if (self.resume and os.path.exists(part)) else None
+        if (entry and entry[0] == url): #the same url as the partial file, only the rest is asked for
+            offset = os.path.getsize(part)
+            headers['Range'] = 'bytes={0}-'.format(offset)
+            if (entry[1]):
+                headers['If-Range'] = entry[1] #the whole file comes again if it changed on the server
+
+        response = self.session.get(url, stream=True, headers=headers)
+
+        if (response.status_code == 416): #the range is wrong, the partial file is thrown away
+            response.close()
+            offset = 0
+            response = self.session.get(url, stream=True)
+
+        if (response.status_code == 404): #the only answer that means there is nothing, the next url is tried
+            self._log.debug('not found: {0}', url)
+            response.close()
+            return None, 0
+
+        if (not response.ok): #throttled, down or refused after the retries of the session: not a miss, the caller tries again in the next run
+            response.close()
+            response.raise_for_status()
+
+        if (offset and response.status_code == 206):
+            STATS.count('download.resumed')
+        else:
+            offset = 0 #the server sent the whole file
+
+        return response, offset
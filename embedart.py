@@ -0,0 +1,58 @@
+import io #the resized cover is kept in memory
+import hashlib #embedded covers are compared by their content
+
+
+EMBEDDED = 'mr_embedded_art' #flexible attribute of an album: sha1 of its cover and maxwidth when the cover was last embedded into all its files
+
+
+def filedigest(path): #sha1 of the cover file, read in blocks
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def coverdata(path, maxwidth): #the bytes to embed: the cover file, made at most maxwidth wide if it is wider
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    if (not maxwidth):
+        return data
+
+    from PIL import Image #pillow, imported only in the worker processes like in artresize.py
+
+    with Image.open(io.BytesIO(data)) as image:
+        if (image.width <= maxwidth):
+            return data
+
+        fmt = image.format
+        height = max(1, int(round(image.height * maxwidth / float(image.width)))) #the same aspect ratio
+        small = image.resize((maxwidth, height), Image.LANCZOS)
+
+    out = io.BytesIO()
+    small.save(out, format=fmt, quality=90)
+    return out.getvalue()
+
+
+def embed(path, targets, maxwidth): #runs in a worker process of the plugin: the cover of one album into its files; returns {target: 'embedded', 'unchanged' or the error}
+    import mediafile #mutagen is loaded only in the worker processes
+
+    data = coverdata(path, maxwidth) #decoded and resized once for all the files of the album
+    digest = hashlib.sha1(data).digest()
+    results = {}
+
+    for target in targets:
+        try:
+            audio = mediafile.MediaFile(target)
+            if (audio.art is not None and hashlib.sha1(audio.art).digest() == digest): #already there, the file is not written again
+                results[target] = 'unchanged'
+                continue
+
+            audio.images = [mediafile.Image(data=data, type=mediafile.ImageType.front)]
+            audio.save()
+            results[target] = 'embedded'
+        except (OSError, mediafile.UnreadableFileError) as exc: #the other files of the album are still written
+            results[target] = str(exc) or type(exc).__name__
+
+    return results
@@ -1,64 +1,146 @@
-from beets import plugins #enables to use the plugins that already exists
-from beets import ui #command operations are defined under this library
-from beets import util #utilization library
-from beets import config #to be able to edit the configuration file of the application
-from beets.plugins import BeetsPlugin #importing beets plugin packet to be able to write a new plugin
-
-import os #operating system support
 import re #regular expressions 
 
 import requests #this library allows to make requests like get, post, etc. 
 from bs4 import BeautifulSoup #BeautifulSoup will be used for fetching lyrics
+from bs4.builder import HTMLParserTreeBuilder #its list of void elements, the fast parser has to nest the tags the same way
+
+from html.parser import HTMLParser #tokenizer of the fast parser, BeautifulSoup's html.parser backend uses it too
 
 import warnings #for warning control
-import html #This module defines functions to manipulate HTML.
-import json #JavaScript Object Notation 
 
-from unidecode import unidecode #takes Unicode data and tries to represent it in ASCII characters
+from httpsession import HTTPSession #connection pool shared by all backends
+from stats import STATS #counters of --stats
+from normalize import ArtistMatcher, artistname, titlename, titlekey #cached normalization of names
+
+
+#compiled once instead of on every page
+LYRICS_CONTAINER = re.compile("Lyrics__Container")
+INREAD_AD = re.compile("InreadAd__Container")
+VOID_TAGS = frozenset(HTMLParserTreeBuilder().empty_element_tags) #<br>, <img>... never contain anything
+PLACEHOLDER = re.compile("LyricsPlaceholder__Message")
+LYRICS_CLASS = re.compile(r'''(?i:class)\s*=\s*(?:"[^"]*(?<![\w-])lyrics(?![\w-])[^"]*"|'[^']*(?<![\w-])lyrics(?![\w-])[^']*'|lyrics[\s/>])''') #a class="lyrics" anywhere in the page, false alarms only cost a full parse
+
+
+class LyricsFound(Exception): #stops LyricsLocator once the lyrics are behind it
+    pass
+
+
+class LyricsLocator(HTMLParser): #finds where the parent of the first Lyrics__Container starts and ends without building a tree
+
+    def __init__(self, html):
+        HTMLParser.__init__(self, convert_charrefs=False)
+        self.html = html
+        self.lines = [0] #offset of the first character of each line, getpos() counts lines and columns
+        for line in html.split('\n'): #getpos() ends lines only at \n, splitlines() would also end them at \r, \x0c, \x85, U+2028...
+            self.lines.append(self.lines[-1] + len(line) + 1)
+        self.stack = [] #(tag, offset) of the open tags, closed the way BeautifulSoup closes them
+        self.parent = None #(tag, offset) of the parent of the first container
+        self.start = self.end = None
+
+    def position(self): #offset of the tag being handled
+        line, column = self.getpos()
+        return self.lines[line - 1] + column
+
+    def handle_starttag(self, tag, attrs):
+        if (self.parent is None and tag == 'div'):
+            classes = dict(attrs).get('class') or ''
+            if (LYRICS_CONTAINER.search(classes)):
+                if (not self.stack): #no parent tag, the full parser handles it
+                    raise LyricsFound()
+                self.parent = self.stack[-1]
+                self.start = self.parent[1]
+
+        if (tag not in VOID_TAGS):
+            self.stack.append((tag, self.position()))
+
+    def handle_startendtag(self, tag, attrs): #<div/> is opened and closed at once, <br/> is never opened
+        self.handle_starttag(tag, attrs)
+        if (tag not in VOID_TAGS):
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        for i in range(len(self.stack) - 1, -1, -1): #closes the most recent open tag with this name and the ones inside it, like BeautifulSoup
+            if (self.stack[i][0] == tag):
+                closed = self.stack[i:]
+                del self.stack[i:]
+                if (self.parent in closed):
+                    position = self.position()
+                    self.end = self.html.find('>', position) + 1 if self.html.startswith('</', position) else position
+                    raise LyricsFound()
+                return
+
+    def locate(self): #(start, end) of the parent in the page, None if the page needs the full parser
+        try:
+            self.feed(self.html)
+            self.close()
+        except LyricsFound:
+            pass
+
+        if (self.start is None or not self.end):
+            return None
+        return self.start, self.end
 
 class Lyric(): #general class for lyrics
 
-    def __init__(self, config, log):
+    def __init__(self, config, log, session=None):
         self._log = log
+        self.session = session or HTTPSession(config, log) #the plugin passes its shared session
 
     def get_url(self, url): #https://www.w3schools.com/python/ref_requests_response.asp
-        try:
-            #https://docs.python.org/3/library/warnings.html
-            with warnings.catch_warnings(): 
-                warnings.simplefilter('ignore') #never print matching warnings
-                req = requests.get(url, verify=False, headers={'User-Agent': 'USER_AGENT',}) 
-        except requests.RequestException as exc:
-            self._log.debug('request failed: {0}', exc)
-            return
+        cached = self.session.cache.get('lyrics', url) #song pages rarely change, earlier responses are reused
+        if (cached is not None):
+            return cached
+
+        #network errors are raised after the retries of the session, so the caller does not take them for missing lyrics
+        #https://docs.python.org/3/library/warnings.html
+        with warnings.catch_warnings(): 
+            warnings.simplefilter('ignore') #never print matching warnings
+            req = self.session.get(url, verify=False) #User-Agent comes from the session headers
+
+        if (req.status_code == 429 or req.status_code >= 500): #still throttled or down after the retries
+            req.raise_for_status()
 
         #status_code returns a number that indicates the status (200 is OK, 404 is Not Found)
         #ok returns True if status_code is less than 400, otherwise False
 
         if (req.status_code == requests.codes.ok):
+            self.session.cache.set('lyrics', url, req.text)
             return req.text #Returns the content of the response, in unicode
         else:
             self._log.debug('failed to fetch: {0} ({1})', url, req.status_code)
 
 class Genius(Lyric): #deriving genius class from lyric class
 
-    url = "https://api.genius.com" #our base url is the api for genius
-
-    def __init__(self, config, log):
-        super(Genius, self).__init__(config, log)
+    def __init__(self, config, log, session=None):
+        super(Genius, self).__init__(config, log, session)
         self.api_key = config['genius_api_key'].as_str() #get the api key from config file
-        self.headers = { #this header implementation was taken from genius directly
+        self.headers = { #this header implementation was taken from genius directly, User-Agent is added by the session
             'Authorization': "Bearer %s" % self.api_key,
-            'User-Agent': "USER_AGENT",
         }
+        config.add({
+            'genius_url': 'https://api.genius.com', #our base url is the api for genius
+            'album_pages': 2, #pages of the artist's song list read by fetchalbum
+            'lyrics_parser': 'fast', #fast parses only the lyrics, full parses the whole page like before
+        })
+        self.url = config['genius_url'].as_str().rstrip('/')
+        self.album_pages = config['album_pages'].get(int)
+        self.names = ArtistMatcher(config) #aliases and fuzzy matching of the artists of the hits
+        self.fastparse = config['lyrics_parser'].as_choice(['fast', 'full']) == 'fast'
 
     def fetch(self, artist, title): 
 
+        url = self.songurl(artist, title)
+        if (url is None):
+            return None
+
+        return self.scrapelyrics(self.get_url(url))
+
+    def songurl(self, artist, title): #the page of the song on Genius, None if the search has no hit by the artist; the asyncio engine calls the steps of fetch one by one
+
         #https://docs.python.org/3/library/json.html this document was really helpful for understanding json library in Python
 
-        title = re.sub(r"[\(\[].*?[\)\]]", "", title) #removing these characters from the song title
-        duet = artist.find("feat.") #find the index of feat.
-        if(duet != -1): #if it exists in the artist name
-            artist = artist[0:duet] #remove the feat and the rest of the artist
+        title = titlename(title) #removing these characters from the song title
+        artist = artistname(artist) #remove the feat and the rest of the artist
         
         json = self.search(artist, title) #Genius does not directly allow to scrape the api, first we try to get a matching url with artist name and title of the song
         #print(json) #used for debugging
@@ -66,24 +148,157 @@ class Genius(Lyric): #deriving genius class from lyric class
             self._log.debug('Invalid JSON')
             return None
 
-        for hit in json["response"]["hits"]: #assigning the artist name 
-            artist_hit = hit["result"]["primary_artist"]["name"]
-
-            if (slugify(artist_hit) == slugify(artist)): #if slugified artist names are equal we scrape lyrics
-                return self.scrapelyrics(self.get_url(hit["result"]["url"])) 
+        #the normalized artist names are equal, or aliases, or close enough; an exact match anywhere in the hits beats an alias or a fuzzy match listed before it
+        hit = self.names.best(artist, json["response"]["hits"], lambda hit: hit["result"]["primary_artist"]["name"])
+        if (hit is not None):
+            return hit["result"]["url"]
 
         self._log.debug('No matching artist {0}', artist)
 
+    def fetchalbum(self, artist, titles): #([lyrics] in the order of titles, API calls made) for several songs of the same artist
+
+        #the first search also tells the Genius id of the artist, then the songs of the artist are listed a page at a time
+        #and each title is looked up in that list, only the titles that are not in it are searched one by one
+
+        artist = artistname(artist)
+
+        calls = 0 #API calls made for this album, the caller compares them with one search per title; not kept on self, fetchalbum runs on several threads at once
+        songs = {} #slugified title -> song page url, filled from the search hits and the artist's song list
+        artist_id = None
+        listed = False #the artist's song list is fetched once
+
+        results = []
+        for title in titles:
+            key = titlekey(title)
+
+            if (key not in songs and artist_id is not None and not listed):
+                listed = True
+                listing, pages = self.artistsongs(artist_id)
+                calls += pages
+                self.addsongs(songs, listing, artist)
+
+            url = songs.get(key)
+            if (url is None): #not seen yet, a search only for this title
+                json = self.search(artist, titlename(title))
+                calls += 1
+                hits = [hit["result"] for hit in json["response"]["hits"]] if json else []
+                self.addsongs(songs, hits, artist)
+
+                hit = self.names.best(artist, hits, lambda hit: hit["primary_artist"]["name"]) #same choice as songurl() when the title does not match any hit
+                if (hit is not None):
+                    if (artist_id is None):
+                        artist_id = hit["primary_artist"]["id"]
+                    url = songs.get(key, hit["url"])
+
+            if (url is None):
+                self._log.debug('No matching artist {0}', artist)
+                results.append(None)
+                continue
+
+            html = self.get_url(url)
+            results.append(self.scrapelyrics(html) if html else None)
+
+        return results, calls
+
+    def addsongs(self, songs, hits, artist): #hits are song objects of the Genius API
+        for hit in hits:
+            if (self.names.match(artist, hit["primary_artist"]["name"])):
+                songs.setdefault(titlekey(hit["title"]), hit["url"])
+
+    def artistsongs(self, artist_id): #(songs of an artist, API calls made), at most album_pages pages of 50
+
+        songs_url = self.url + "/artists/{0}/songs".format(artist_id)
+        songs = []
+        calls = 0
+
+        for page in range(1, self.album_pages + 1):
+            params = {'per_page': 50, 'page': page, 'sort': 'popularity'}
+
+            json = self.session.cache.get_json('search', songs_url, params)
+            if (json is None):
+                response = self.session.get(songs_url, params=params, headers=self.headers)
+                calls += 1
+                if (response.status_code == 429 or response.status_code >= 500):
+                    response.raise_for_status()
+                if (not response.ok):
+                    self._log.debug('failed to list songs: {0} ({1})', songs_url, response.status_code)
+                    break
+                self.session.cache.set('search', songs_url, response.text, params)
+                json = response.json()
+
+            songs.extend(json["response"]["songs"])
+            if (not json["response"].get("next_page")): #last page
+                break
+
+        return songs, calls
+
     def search(self, artist, title):
 
         search_url = self.url + "/search" #obtained: https://api.genius.com/search
         data = {'q': title + " " + artist.lower()} #data is our query statement
-        response = requests.get(search_url, data=data, headers=self.headers) #we try to get a response from this query (with artist name, title and specified headers)
 
-        return response.json() 
+        cached = self.session.cache.get_json('search', search_url, data) #the same query was made in an earlier run
+        if (cached is not None):
+            return cached
+
+        response = self.session.get(search_url, data=data, headers=self.headers) #we try to get a response from this query (with artist name, title and specified headers)
+
+        if (response.status_code == 429 or response.status_code >= 500): #still throttled or down after the retries, not a miss
+            response.raise_for_status()
+
+        if (not response.ok): #error pages are never cached, and they are not JSON
+            self._log.debug('search failed: {0} ({1})', search_url, response.status_code)
+            return None
+
+        try:
+            json = response.json()
+        except ValueError: #an HTML error page with a 200 status
+            self._log.debug('search answer is not JSON: {0}', search_url)
+            return None
+
+        self.session.cache.set('search', search_url, response.text, data)
+        return json
 
 
     def scrapelyrics(self, html):
+        if (not html): #get_url failed
+            return None
+
+        with STATS.timer('parse'):
+            if (self.fastparse):
+                lyrics = self.fastlyrics(html)
+                if (lyrics is not None):
+                    return lyrics
+                STATS.count('parse_fallbacks')
+            return self.parselyrics(html)
+
+    def fastlyrics(self, html): #parses only the element around the lyrics containers, None means the full parser has to decide
+
+        if ("Lyrics__Container" not in html or LYRICS_CLASS.search(html)): #no containers, or the old page layout where the full parser looks for div.lyrics first
+            return None
+
+        region = LyricsLocator(html).locate()
+        if (region is None):
+            return None
+
+        soup = BeautifulSoup(html[region[0]:region[1]], "html.parser") #the same subtree the full parser would build, nothing else
+
+        [h.extract() for h in soup('script')]
+
+        div2 = soup.find("div", class_=LYRICS_CONTAINER)
+        lyrics_div = div2.parent if div2 else None
+        if (lyrics_div is None or lyrics_div.parent is not soup): #the region is not what LyricsLocator expected
+            return None
+
+        for breaks in lyrics_div.find_all("br"):
+            breaks.replace_with("\n")
+
+        for ad in lyrics_div.find_all("div", class_=INREAD_AD):
+            ad.replace_with("\n")
+
+        return lyrics_div.get_text()
+
+    def parselyrics(self, html): #the full parser, it reads the whole page
 
         soup = BeautifulSoup(html, "html.parser") #https://www.crummy.com/software/BeautifulSoup/bs4/doc/ soup holds the content of the desired page.
 
@@ -92,9 +307,9 @@ class Genius(Lyric): #deriving genius class from lyric class
         lyrics_div = soup.find("div", class_="lyrics") #find the div with the lyrics class
         if (not lyrics_div): #if can not be found
             self._log.debug('Unusual song page') 
-            div2 = soup.find("div", class_=re.compile("Lyrics__Container")) #Compile a regular expression pattern into a regular expression object
+            div2 = soup.find("div", class_=LYRICS_CONTAINER) #Compile a regular expression pattern into a regular expression object
             if (not div2): #if can not be found
-                if soup.find("div", class_=re.compile("LyricsPlaceholder__Message"), string="This song is an instrumental"): #if a placeholder statement is found
+                if soup.find("div", class_=PLACEHOLDER, string="This song is an instrumental"): #if a placeholder statement is found
                     self._log.debug('Thid is an instrumental song') #instrumental song 
                     return "[Instrumental]" #this would be stored as the lyrics 
                 else:
@@ -108,14 +323,10 @@ class Genius(Lyric): #deriving genius class from lyric class
                 breaks.replace_with("\n")
 
             #finding ads and replacing them with end of line character
-            ads = lyrics_div.find_all("div", class_=re.compile("InreadAd__Container"))
+            ads = lyrics_div.find_all("div", class_=INREAD_AD)
 
             for ad in ads:
                 ad.replace_with("\n")
 
         return lyrics_div.get_text() #return the text we scraped from the webpage
 
-def slugify(text):
-    #The unicode module exports a function that takes a string and returns a string that can be encoded to ASCII bytes in Python 3
-    return re.sub(r'\W+', '-', unidecode(text).lower().strip()).strip('-') #we lower unicoded text and remove spaces at the beginning and end of the string, sub replaces \W+ characters in this text with -. Then we remove -'s.
-
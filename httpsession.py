@@ -0,0 +1,123 @@
+import beets #only used for the version number in the User-Agent header
+
+import time #waiting between retries
+
+import requests #this library allows to make requests like get, post, etc.
+from requests.adapters import HTTPAdapter #keeps a pool of open connections for each host
+
+from responsecache import ResponseCache #bodies of earlier responses
+from stats import STATS #counters of --stats
+from throttle import Throttle, retryafter #rate limit, retries and circuit breaker of each host
+
+from urllib.parse import urlsplit #requests are counted per host
+
+
+class HTTPSession(): #a single requests.Session shared by every backend of the plugin, so repeated calls to the same host reuse the connection
+
+    def __init__(self, config, log):
+        self._log = log
+
+        config['http'].add({ #default values, overridden by config.yaml
+            'timeout': 10, #seconds to wait for the server
+            'pool_connections': 10, #number of hosts whose connections are kept open
+            'pool_size': 10, #number of open connections kept for each host, raised to workers and async: concurrency when they are higher
+            'user_agent': 'beets/{0} metadata_retriever'.format(beets.__version__),
+        })
+
+        http = config['http']
+        self.timeout = http['timeout'].as_number()
+        self.pool_connections = http['pool_connections'].get(int)
+        self.pool_size = 0
+
+        self.session = requests.Session()
+        self.poolsize(http['pool_size'].get(int))
+        self.session.headers.update({'User-Agent': http['user_agent'].as_str()}) #sent with every request, backends only add their own headers
+
+        self.cache = ResponseCache(config, log) #backends look here before making a request
+        self.throttle = Throttle(config, log) #musicbrainzngs does not use this session, allreleases calls self.throttle.call for it
+
+    def poolsize(self, size): #keeps at least size connections open for each host, so size threads at once never open and discard extra ones
+        if (size <= self.pool_size):
+            return
+
+        adapter = HTTPAdapter( #https://requests.readthedocs.io/en/master/user/advanced/#transport-adapters
+            pool_connections=self.pool_connections,
+            pool_maxsize=size,
+        )
+        old = self.session.adapters.get('https://')
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.pool_size = size
+
+        if (old is not None): #its idle connections, called between the stages, when no request is running
+            old.close()
+
+    def get(self, url, **kwargs): #same arguments as requests.get; throttled per host, retried on connection errors, 429 and 5xx
+        kwargs.setdefault('timeout', self.timeout)
+
+        host = urlsplit(url).netloc
+        throttle = self.throttle.host(host)
+        retries = self.throttle.retries
+
+        for attempt in range(retries + 1):
+            throttle.acquire() #HostUnavailable while the host is down
+
+            try:
+                response = self.send(host, url, kwargs)
+            except (requests.ConnectionError, requests.Timeout) as exc:
+                throttle.failure()
+                if (attempt == retries):
+                    raise
+                self._log.debug('retrying {0}: {1}', url, exc)
+                STATS.count('retries.' + host)
+                time.sleep(self.throttle.delay(attempt))
+                continue
+
+            delay = None
+            if (response.status_code in (429, 503)): #too many requests, or busy
+                delay = retryafter(response.headers.get('Retry-After'))
+                throttle.throttled(min(delay, self.throttle.max_backoff) if delay else None)
+            if (response.status_code >= 500):
+                throttle.failure()
+            elif (response.status_code != 429):
+                throttle.success()
+                return response
+
+            if (attempt == retries or (delay or 0) > self.throttle.max_backoff): #the caller decides what to do with the error
+                return response
+
+            self._log.debug('retrying {0}: {1}', url, response.status_code)
+            STATS.count('retries.' + host)
+            response.content #the error body is read, so the connection goes back to the pool
+            time.sleep(max(delay or 0, self.throttle.delay(attempt)))
+
+    def send(self, host, url, kwargs): #one request, counted for --stats
+        if (not STATS.enabled):
+            return self.session.get(url, **kwargs)
+
+        STATS.count('requests.' + host)
+
+        try:
+            with STATS.timer('http.' + host): #connecting and waiting for the headers, streamed bodies are read later
+                response = self.session.get(url, **kwargs)
+        except requests.RequestException:
+            STATS.count('http_errors.' + host)
+            raise
+
+        if (not response.ok):
+            STATS.count('http_errors.' + host)
+
+        length = response.headers.get('Content-Length')
+        if (length is None and not kwargs.get('stream')):
+            length = len(response.content)
+        STATS.count('bytes.' + host, int(length or 0))
+
+        pool = getattr(response.raw, '_pool', None) #the urllib3 pool of the host, a new connection means a new TCP and TLS handshake
+        if (pool is not None):
+            STATS.set('connections.' + host, pool.num_connections)
+
+        return response
+
+    def close(self):
+        self.session.close()
+        self.cache.close()
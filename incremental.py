@@ -0,0 +1,85 @@
+from beets import config as beets_config #to find the configuration directory of beets
+from beets.dbcore import query as dbquery #queries that SQLite evaluates
+
+import os #operating system support
+import json #the watermarks are kept in a small JSON file
+
+from sidestore import librarykey #the watermarks are kept per library, like the stores keyed by item ids
+
+
+class EmptyQuery(dbquery.FieldQuery): #the field is NULL or empty; for fixed fields SQLite does the filtering
+
+    def __init__(self, field, fast=True):
+        super(EmptyQuery, self).__init__(field, None, fast)
+
+    def col_clause(self):
+        return "({0} IS NULL OR {0} = '' OR {0} = X'')".format(self.field), ()
+
+    @classmethod
+    def value_match(cls, pattern, value):
+        return not value
+
+
+LYRICS_STORED = 'mr_lyrics_stored' #flexible attribute, the time the lyrics of an item were last stored; storing lyrics changes neither added nor mtime
+
+
+class StampQuery(dbquery.FieldQuery): #the flexible attribute field holds a time at or after the pattern; SQLite looks it up in the attribute table
+
+    def __init__(self, field, watermark, table='item_attributes'):
+        self.table = table
+        super(StampQuery, self).__init__(field, watermark, True)
+
+    def col_clause(self): #flexible attributes are stored as text
+        return 'id IN (SELECT entity_id FROM {0} WHERE key = ? AND CAST(value AS REAL) >= ?)'.format(self.table), [self.field, self.pattern]
+
+    def match(self, obj): #like the SQL, an object without the attribute never matches
+        try:
+            return self.field in obj and float(obj[self.field]) >= self.pattern
+        except ValueError:
+            return False
+
+
+def changedsince(fields, watermark, stamps=()): #items whose fields (added, mtime) or flexible time stamps are at or after the watermark
+    queries = [dbquery.NumericQuery(field, '{0!r}..'.format(watermark)) for field in fields]
+    return dbquery.OrQuery(queries + [StampQuery(stamp, watermark) for stamp in stamps])
+
+
+class Watermarks(): #start time of the last complete run of each stage, per library
+
+    def __init__(self, config, log):
+        self._log = log
+
+        config['incremental'].add({ #default values, overridden by config.yaml
+            'enabled': False, #like --incremental on every run
+            'path': '', #empty means metadata_retriever_watermarks.json in the beets configuration directory
+        })
+
+        incremental = config['incremental']
+        self.enabled = incremental['enabled'].get(bool)
+        self.path = incremental['path'].as_filename() if incremental['path'].get() else \
+            os.path.join(beets_config.config_dir(), 'metadata_retriever_watermarks.json')
+
+    def read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def key(self, lib): #the database file of the library
+        return librarykey(lib)
+
+    def get(self, lib, stage): #0 means the stage never ran, so everything is new
+        return self.read().get(self.key(lib), {}).get(stage, 0)
+
+    def set(self, lib, marks): #marks: stage -> time the stage started, written only after the run stored its changes
+        data = self.read()
+        key = self.key(lib)
+        data.setdefault(key, {}).update(marks)
+
+        temporary = self.path + '.part'
+        with open(temporary, 'w') as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+        os.replace(temporary, self.path) #never a half written file
+
+        self._log.debug('watermarks of {0}: {1}', key, marks)
@@ -0,0 +1,91 @@
+from sidestore import SideStore #the index is an SQLite FTS5 table next to the library
+from stats import STATS #counters of --stats
+
+
+class LyricsIndex(SideStore): #full-text index of the lyrics in the library, the rowid of each song is its item id, so there is one for each library
+
+    def __init__(self, config, log):
+        self._log = log
+
+        config['search'].add({ #default values, overridden by config.yaml
+            'path': '', #empty means metadata_retriever_lyrics_<library>.db in the beets configuration directory
+            'limit': 20, #results printed by --search
+            'batch': 500, #songs written to the index in one transaction
+        })
+
+        search = config['search']
+        self.limit = search['limit'].get(int)
+        self.batch = max(1, search['batch'].get(int))
+        super(LyricsIndex, self).__init__('lyrics', [
+            "CREATE VIRTUAL TABLE IF NOT EXISTS songs USING fts5(artist, title, lyrics, tokenize = 'unicode61 remove_diacritics 2')",
+        ], search['path'].as_filename() if search['path'].get() else '', library=True)
+
+        self.pending = 0 #changes since the last commit
+
+    def update(self, item): #called when lyrics are stored, committed in batches by flush()
+        with self._lock:
+            db = self.connection()
+            db.execute('DELETE FROM songs WHERE rowid = ?', (item.id,))
+            if (item.lyrics):
+                db.execute('INSERT INTO songs (rowid, artist, title, lyrics) VALUES (?, ?, ?, ?)', (item.id, item.artist, item.title, item.lyrics))
+
+            self.pending += 1
+            if (self.pending >= self.batch):
+                self.commit(db)
+
+        STATS.count('index.updated')
+
+    def add(self, rows): #rows [(item id, artist, title, lyrics)] of a bulk load, committed with them
+        with self._lock:
+            db = self.connection()
+            db.executemany('DELETE FROM songs WHERE rowid = ?', [(row[0],) for row in rows])
+            db.executemany('INSERT INTO songs (rowid, artist, title, lyrics) VALUES (?, ?, ?, ?)', [row for row in rows if row[3]])
+            self.commit(db)
+
+        STATS.count('index.updated', len(rows))
+
+    def commit(self, db):
+        db.commit()
+        self.pending = 0
+
+    def flush(self):
+        with self._lock:
+            if (self._db is not None and self.pending):
+                self.commit(self._db)
+
+    def rebuild(self, items): #replaces the whole index with the lyrics of the given items, returns their number
+        count = 0
+
+        with self._lock:
+            db = self.connection()
+            db.execute('DELETE FROM songs')
+            rows = ((item.id, item.artist, item.title, item.lyrics) for item in items if item.lyrics)
+
+            while (True):
+                chunk = [row for _, row in zip(range(self.batch), rows)]
+                if (not chunk):
+                    break
+                db.executemany('INSERT INTO songs (rowid, artist, title, lyrics) VALUES (?, ?, ?, ?)', chunk)
+                count += len(chunk)
+
+            db.execute("INSERT INTO songs (songs) VALUES ('optimize')") #merges the index segments, the first searches are faster
+            self.commit(db)
+
+        return count
+
+    def search(self, phrase, limit=None): #[(item id, artist, title, snippet)] best match first
+        query = 'lyrics : "{0}"'.format(phrase.replace('"', '""')) #the words in this order in the lyrics column, FTS5 operators in the phrase are not interpreted
+
+        with self._lock:
+            rows = self.connection().execute(
+                "SELECT rowid, artist, title, snippet(songs, 2, '[', ']', '...', 12) FROM songs WHERE songs MATCH ? ORDER BY rank LIMIT ?",
+                (query, limit or self.limit))
+            return rows.fetchall()
+
+    def __len__(self): #counts every row of the index, empty() is the fast check
+        with self._lock:
+            return self.connection().execute('SELECT COUNT(*) FROM songs').fetchone()[0]
+
+    def empty(self): #stops at the first row
+        with self._lock:
+            return self.connection().execute('SELECT 1 FROM songs LIMIT 1').fetchone() is None
@@ -0,0 +1,59 @@
+#runs in the worker processes of --jobs: fetches and parses lyrics, never touches the library, the plugin process stores the results
+
+import logging #the worker logs like the plugin
+import importlib #the backends are named by their module and class
+
+RESOLVER = None #the lyrics backends of this process behind a LyricsResolver, made by start()
+
+
+def start(settings, backends, options): #initializer of the process pool; settings is the flattened configuration of the plugin, backends [(name, module, class)], options the command line flags of the run
+    global RESOLVER
+
+    from beets import config
+    config['metadata_retriever'].set(settings)
+    view = config['metadata_retriever']
+    log = logging.getLogger('beets.metadata_retriever')
+
+    from httpsession import HTTPSession
+    from resolver import LyricsResolver
+    from stats import STATS
+
+    STATS.enabled = options['stats'] #the numbers go back to the plugin process with the results
+    session = HTTPSession(view, log) #one connection pool for the backends of this process
+    session.cache.enabled = options['cache'] #--no-cache
+    session.cache.refresh = options['refresh'] #--refresh
+
+    names, objects = [], []
+    for name, module, classname in backends:
+        cls = getattr(importlib.import_module(module), classname)
+        names.append(name)
+        objects.append(cls(view, log, session=session))
+
+    RESOLVER = LyricsResolver(names, objects, view, log)
+
+
+def fetch(songs, byalbum): #songs: [(artist, title)] of one album; returns ([(lyrics, error)], API calls made, --stats numbers of the call or None)
+    from stats import STATS
+
+    results, calls = fetchsongs(songs, byalbum)
+    return results, calls, (STATS.take() if STATS.enabled else None)
+
+
+def fetchsongs(songs, byalbum):
+    import requests
+
+    name, backend = RESOLVER.first()
+    if (byalbum and len(songs) > 1 and hasattr(backend, 'fetchalbum')):
+        try:
+            lyrics, calls = RESOLVER.call(name, 'fetchalbum', songs[0][0], [title for artist, title in songs])
+            return [(text, None) for text in lyrics], calls
+        except requests.RequestException as exc: #not a miss, the songs are tried again in the next run
+            return [(None, str(exc))] * len(songs), 0
+
+    results = []
+    for artist, title in songs:
+        try:
+            results.append((RESOLVER.fetch(artist, title), None))
+        except requests.RequestException as exc:
+            results.append((None, str(exc)))
+    return results, len(songs)
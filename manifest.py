@@ -0,0 +1,170 @@
+#JSON Lines manifests of the offline backfills: --export-missing writes what the library lacks, a fetcher
+#run anywhere answers it, and --ingest loads the answers back
+#
+#    beet metadata_retriever --export-missing missing.jsonl [-c] [-l] [query]
+#    python manifest.py missing.jsonl results.jsonl --images covers/ [--jobs 8]
+#    beet metadata_retriever --ingest results.jsonl
+#
+#one JSON object per line. The manifest has {"kind": "album", "id", "mb_albumid", ...} and
+#{"kind": "item", "id", "artist", "title", ...}; the results file has {"kind", "id"} and "lyrics" or
+#"image" (null when the source has nothing), or "error" when the request failed and should be tried again.
+
+import os #operating system support
+import sys #the results can be written to the standard output
+import json #JavaScript Object Notation
+import itertools #the records are read in chunks
+
+from stats import STATS #counters of --stats
+
+
+ALBUM_FIELDS = ['id', 'mb_albumid', 'mb_releasegroupid', 'albumartist', 'album'] #what CoverArtArchive.get needs, and enough to recognize the album
+ITEM_FIELDS = ['id', 'album_id', 'artist', 'title', 'album', 'mb_trackid'] #what the lyrics backends search with
+
+
+def albumrecord(album):
+    record = {'kind': 'album'}
+    for field in ALBUM_FIELDS:
+        record[field] = album.get(field)
+    return record
+
+
+def itemrecord(item):
+    record = {'kind': 'item'}
+    for field in ITEM_FIELDS:
+        record[field] = item.get(field)
+    return record
+
+
+class ManifestWriter(): #writes one record per line; a file is written under a temporary name and renamed at the end, '-' is the standard output
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+
+    def __enter__(self):
+        if (self.path == '-'):
+            self.file = sys.stdout
+        else:
+            self.file = open(self.path + '.part', 'w', encoding='utf-8')
+        return self
+
+    def write(self, record):
+        self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self.count += 1
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if (self.path == '-'):
+            self.file.flush()
+            return False
+
+        self.file.close()
+        if (exc_type is None):
+            os.replace(self.path + '.part', self.path) #an interrupted export does not leave half a manifest behind
+        else:
+            os.remove(self.path + '.part')
+        return False
+
+
+def readrecords(path, log): #yields the records of a manifest or results file, lines that are not JSON objects are logged and skipped
+    stream = sys.stdin if path == '-' else open(path, encoding='utf-8')
+
+    try:
+        for number, line in enumerate(stream, 1):
+            line = line.strip()
+            if (not line):
+                continue
+
+            try:
+                record = json.loads(line)
+            except ValueError as exc:
+                record = None
+                log.warning('{0}:{1}: not JSON: {2}', path, number, exc)
+
+            if (isinstance(record, dict) and record.get('kind') in ('album', 'item') and isinstance(record.get('id'), int)):
+                STATS.count('manifest.read')
+                yield record
+            elif (record is not None):
+                log.warning('{0}:{1}: not an album or item record', path, number)
+    finally:
+        if (stream is not sys.stdin):
+            stream.close()
+
+
+def chunks(records, size): #lists of at most size records
+    records = iter(records)
+    while (True):
+        chunk = list(itertools.islice(records, size))
+        if (not chunk):
+            return
+        yield chunk
+
+
+def fetchrecord(plugin, record, images): #runs on a worker thread: the result of one manifest record
+    import requests
+
+    result = {'kind': record['kind'], 'id': record['id']}
+
+    try:
+        if (record['kind'] == 'item'):
+            result['lyrics'] = plugin.resolver.fetch(record.get('artist') or '', record.get('title') or '')
+        else:
+            directory = os.path.join(images, str(record['id'])) #CoverArtArchive.get always writes cover.jpg, one directory per album
+            os.makedirs(directory, exist_ok=True)
+            album = Release(record.get('mb_albumid'))
+            result['image'] = plugin.fetchcover(album, [directory]) #resized to maxwidth like in the library
+    except requests.RequestException as exc:
+        result['error'] = str(exc)
+
+    return result
+
+
+class Release(): #the part of an Album that CoverArtArchive.get reads
+
+    def __init__(self, mb_albumid):
+        self.mb_albumid = mb_albumid
+
+
+def main(): #the fetcher: answers a manifest without a library, with the sources and settings of the plugin
+    import argparse
+    import logging
+    import collections
+    from concurrent import futures
+
+    parser = argparse.ArgumentParser(description='fetch the lyrics and cover art listed in a metadata_retriever manifest')
+    parser.add_argument('manifest', help='written by "beet metadata_retriever --export-missing", - for the standard input')
+    parser.add_argument('results', help='for "beet metadata_retriever --ingest", - for the standard output')
+    parser.add_argument('--images', default='covers', help='directory of the downloaded covers')
+    parser.add_argument('--jobs', type=int, help='requests at the same time, the workers option by default')
+    parser.add_argument('--config', help='beets configuration file with the metadata_retriever settings')
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__))) #the plugin modules are next to this file
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    from beets import config
+    config.read(user=True, defaults=True)
+    if (args.config):
+        config.set_file(args.config)
+
+    import metadata_retriever
+    plugin = metadata_retriever.metadata_retriever()
+    log = plugin._log
+    jobs = max(1, args.jobs or plugin.workers)
+    images = os.path.abspath(args.images)
+
+    pending = collections.deque() #futures in the order of the manifest, at most 2 * jobs of them
+    with futures.ThreadPoolExecutor(max_workers=jobs) as executor, ManifestWriter(args.results) as writer:
+        for record in readrecords(args.manifest, log):
+            pending.append(executor.submit(fetchrecord, plugin, record, images))
+            if (len(pending) >= 2 * jobs): #keeping the window bounded so that huge manifests do not fill the memory
+                writer.write(pending.popleft().result())
+
+        while (pending):
+            writer.write(pending.popleft().result())
+
+    plugin.stopprocesses()
+    log.info('wrote {0} results to {1}', writer.count, args.results)
+
+
+if __name__ == '__main__':
+    main()
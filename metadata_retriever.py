@@ -2,60 +2,186 @@ from beets import plugins #enables to use the plugins that already exists
 from beets import ui #command operations are defined under this library
 from beets import util #utilization library
 from beets import config #to be able to edit the configuration file of the application
+from beets import library #queries of the incremental mode are built from the command line arguments
+from beets.dbcore import query as dbquery
 from beets.plugins import BeetsPlugin #importing beets plugin packet to be able to write a new plugin
 
 import os #operating system support
+import time #start time of the incremental runs
 import re #regular expressions 
+import collections #deque is used as a bounded window of pending downloads
+import itertools #groupby is used for grouping the items by album
+import threading #background worker of the imports
+import contextlib #for the batch() context manager
+import multiprocessing #covers are resized in worker processes
+import shutil #covers of --ingest are copied into the album directories
+import hashlib #covers of the releases are compared by their content
+from concurrent import futures #thread pool for downloading cover arts in parallel
+from urllib.parse import urlsplit #downloads are limited per host
 
-import requests #this library allows to make requests like get, post, etc. 
-from bs4 import BeautifulSoup #BeautifulSoup will be used for fetching lyrics
-
-import warnings #for warning control
-import html #This module defines functions to manipulate HTML.
 import json #JavaScript Object Notation 
-from unidecode import unidecode #takes Unicode data and tries to represent it in ASCII characters
+import importlib #the lyrics backends are imported on first use
+
+#requests, bs4, musicbrainzngs, Pillow and wordcloud are imported by the stages that use them, so that
+#every beet command, even "beet ls", does not pay for them once the plugin is enabled; see benchmarks/startup.py
 
-import musicbrainzngs #this library is used to reach Musicbrainz API directly to find all releases
-from wordcloud import WordCloud #used for creating wordclouds of albums
+from misses import MissMemo
+from workqueue import WorkQueue
+from dbwriter import BatchWriter
+from stats import STATS
+from incremental import Watermarks, EmptyQuery, changedsince, LYRICS_STORED
+from wordfreq import WordCounts
+from lyricsindex import LyricsIndex
+from shards import ShardQuery, ShardLock, parseshard
+import lyricsworker
+import wordfreq
 
-import unittest
 
-from coverart import *
-from getlyrics import *
+def cleanlyrics(lyrics): #the lyrics as they are stored: without the whitespace around them and the [Chorus], (x2) notes
+    lyrics = lyrics.strip()
+    return re.sub(r"[\(\[].*?[\)\]]", "", lyrics)
 
 
 class metadata_retriever(BeetsPlugin): #derived from BeetsPlugin and RequestLogger
 
-    LYRIC = ['genius'] #name of our source
-    SOURCE_LYRICS = { #defining which class to call 
-        'genius': Genius
+    LYRIC = ['genius'] #default of the lyric option, the names of the backends in priority order
+    SOURCE_LYRICS = { #defining which class to call, module and class name, imported on first use
+        'genius': ('getlyrics', 'Genius')
     }
     
     def __init__(self): #constructor
 
         super(metadata_retriever, self).__init__()
 
+        self.config.add({ #default values, overridden by config.yaml
+            'auto': True,
+            'maxwidth': 0,
+            'lyric': list(self.LYRIC),
+            'high_resolution': False, #download the original images and resize them locally instead of the archive's thumbnails
+            'cover_name': ['cover'],
+            'workers': 4, #number of cover arts downloaded at the same time
+            'lyrics_by_album': False, #search the lyrics of an album together, see Genius.fetchalbum
+            'background': False, #imported albums are only queued, a background thread or --drain fetches them
+            'background_lyrics': True, #the queued albums get their lyrics too, not only the cover art
+            'batch_size': 100, #albums and items stored in one transaction
+            'stats': False, #print the counters and timers of every run, like --stats
+            'per_host': 4, #downloads running at the same time from one host in allreleases
+            'allreleases_links': True, #duplicate release covers are hardlinks of the first copy, otherwise only covers.json lists them
+            'ingest_batch': 10000, #results of --ingest stored in one transaction
+            'async_lyrics': False, #fetch the lyrics with the asyncio engine, like --async
+            'embed': False, #write the cover art into the tags of the files after -c and imports, like -e
+        })
+
         self.maxwidth = self.config['maxwidth'].get(int) #it can be up to 2000 as defined in config.yaml
 
         self.cover_name = self.config['cover_name'].as_str_seq() #bytestring_path: Given a path, which is either a bytes or a unicode, returns a str path (ensuring that we never deal with Unicode pathnames).
 
-        if (self.config['auto']): #importing our plugin
-            self.import_stages = [self.metadata_retriever]
+        self.workers = max(1, self.config['workers'].get(int)) #at least one download thread
 
-        available_source = list(SOURCE) #putting our source into a list
-        
-        available_source = [(s, c) for s in available_source for c in ART_SOURCE[s].Type] #creating a list as [(CoverArtArchive, release)]
- 
-        self.source = [ART_SOURCE[s](self._log, self.config, match_by=[c]) for s, c in available_source]
+        self.misses = MissMemo(self.config, self._log) #albums and items that are not retried on every run
+
+        self.savedcalls = 0 #Genius API calls saved by the album mode
+
+        self.local = threading.local() #the BatchWriter of each thread, see batch()
+
+        per_host = max(1, self.config['per_host'].get(int))
+        self.hostlimits = collections.defaultdict(lambda: threading.BoundedSemaphore(per_host)) #host -> downloads allowed at the same time
+
+        self.processes = None #process pool of the resizing and the word clouds, started on first use
+        self.processlock = threading.Lock()
+
+        self.embed = self.config['embed'].get(bool)
+
+        self.words = WordCounts(self.config, self._log) #word frequencies of each artist and album for the word clouds
+
+        self.index = LyricsIndex(self.config, self._log) #full-text index of the stored lyrics, for --search
+
+        self.watermarks = Watermarks(self.config, self._log) #start time of the last run of each stage, for --incremental
+
+        self.failed = collections.Counter() #stage -> requests that failed in this run, its watermark stays where it was
+
+        self.shard = None #(index, count) of --shard, the queries of the run only return the rows of this shard
 
+        self.queue = WorkQueue(self.config, self._log) #albums queued by imports in background mode
+        self.worker = None #background thread draining the queue during an import
+        self.wakeup = threading.Event() #set when an import queues an album
+        self.stopping = False
 
-        available_sources = list(self.LYRIC)
+        if (self.config['auto'].get(bool)): #importing our plugin
+            self.register_listener('album_imported', self.imported) #not an import stage: the stages run before the files are moved, and at the same time as that
+            if (self.config['background'].get(bool)):
+                self.register_listener('cli_exit', self.stopworker)
 
-        self.backends = [self.SOURCE_LYRICS[i](self.config, self._log) for i in available_sources]
+        self.register_listener('cli_exit', self.stopprocesses)
+        self.register_listener('cli_exit', self.closestores)
+
+        self._session = None #the session, the cover art sources and the lyrics backends are made on first use
+        self._source = None
+        self._backends = None
+        self._resolver = None
+        self.lyricsources = self.lyricnames() #names of the lyrics backends in priority order
+        self.lazylock = threading.RLock() #the first use can be on a download thread
 
         self.config['genius_api_key'].redact = True
 
 
+    @property
+    def session(self): #one connection pool for the whole plugin
+        with self.lazylock:
+            if (self._session is None):
+                from httpsession import HTTPSession
+                self._session = HTTPSession(self.config, self._log)
+                self._session.poolsize(self.workers) #a connection for each download thread
+            return self._session
+
+
+    @property
+    def source(self):
+        with self.lazylock:
+            if (self._source is None):
+                from coverart import SOURCE, ART_SOURCE
+
+                available_source = list(SOURCE) #putting our source into a list
+        
+                available_source = [(s, c) for s in available_source for c in ART_SOURCE[s].Type] #creating a list as [(CoverArtArchive, release)]
+
+                self._source = [ART_SOURCE[s](self._log, self.config, match_by=[c], session=self.session) for s, c in available_source]
+            return self._source
+
+
+    @property
+    def backends(self):
+        with self.lazylock:
+            if (self._backends is None):
+                available_sources = self.lyricsources
+
+                backends = []
+                for i in available_sources:
+                    module, name = self.SOURCE_LYRICS[i]
+                    backends.append(getattr(importlib.import_module(module), name)(self.config, self._log, session=self.session))
+                self._backends = backends
+            return self._backends
+
+
+    @property
+    def resolver(self): #asks the backends in the order of the lyric option, with hedged requests
+        with self.lazylock:
+            if (self._resolver is None):
+                from resolver import LyricsResolver
+                self._resolver = LyricsResolver(self.lyricsources, self.backends, self.config, self._log)
+            return self._resolver
+
+
+    def lyricnames(self): #the lyric option without the names that are not in SOURCE_LYRICS
+        names = []
+        for name in self.config['lyric'].as_str_seq():
+            if (name in self.SOURCE_LYRICS and name not in names):
+                names.append(name)
+            elif (name not in self.SOURCE_LYRICS):
+                self._log.warning('unknown lyrics source {0}, known sources: {1}', name, ', '.join(sorted(self.SOURCE_LYRICS)))
+        return names or list(self.LYRIC)
+
+
     def commands(self): #this function adds metadata_retriever to beets command list
 
         command = ui.Subcommand('metadata_retriever', help='fetch cover art and lyrics') # :)
@@ -74,6 +200,11 @@ class metadata_retriever(BeetsPlugin): #derived from BeetsPlugin and RequestLogg
             action='store_true', default=False,
             help='find cover arts for all releases',
         )
+        command.parser.add_option( #embedding cover arts
+            '-e', '--embed', dest='embed',
+            action='store_true', default=False,
+            help='write the cover arts of the albums into their audio files',
+        )
         command.parser.add_option( #printing lyrics of each song to command line
             '-p', '--print', dest='printlyrics',
             action='store_true', default=False,
@@ -84,84 +215,810 @@ class metadata_retriever(BeetsPlugin): #derived from BeetsPlugin and RequestLogg
             action='store_true', default=False,
             help='write lyrics to a text file',
         )
+        command.parser.add_option( #searching lyrics album by album
+            '-b', '--by-album', dest='byalbum',
+            action='store_true', default=None,
+            help='search the lyrics of the songs of an album together',
+        )
+        command.parser.add_option( #processing the albums queued by imports
+            '--drain', dest='drain',
+            action='store_true', default=False,
+            help='fetch cover art and lyrics of the albums queued during imports',
+        )
+        command.parser.add_option( #ignoring the response cache
+            '--no-cache', dest='nocache',
+            action='store_true', default=False,
+            help='do not read or write the response cache',
+        )
+        command.parser.add_option( #updating the response cache
+            '--refresh', dest='refresh',
+            action='store_true', default=False,
+            help='fetch everything again and update the response cache',
+        )
+        command.parser.add_option( #counters and timers of the run
+            '--stats', dest='stats',
+            action='store_true', default=False,
+            help='print requests, bytes, cache hits and timings at the end',
+        )
+        command.parser.add_option( #exporting the counters and timers
+            '--stats-file', dest='statsfile', metavar='FILE',
+            help='write the statistics of the run to FILE',
+        )
+        command.parser.add_option(
+            '--stats-format', dest='statsformat', default='json',
+            type='choice', choices=['json', 'prometheus'],
+            help='format of --stats-file: json or prometheus',
+        )
+        command.parser.add_option( #searching the lyrics index
+            '--search', dest='search', metavar='PHRASE',
+            help='print the songs whose lyrics contain the phrase, best match first',
+        )
+        command.parser.add_option(
+            '--search-limit', dest='searchlimit', type='int',
+            help='number of songs printed by --search',
+        )
+        command.parser.add_option( #filling the lyrics index from the library
+            '--rebuild-index', dest='rebuildindex',
+            action='store_true', default=False,
+            help='rebuild the lyrics search index from the lyrics in the library',
+        )
+        command.parser.add_option( #manifest of an offline backfill, see manifest.py
+            '--export-missing', dest='exportmissing', metavar='FILE',
+            help='write the albums without cover art and the songs without lyrics to FILE as JSON lines (- for stdout); -c or -l alone limits it to one of them',
+        )
+        command.parser.add_option( #results of an offline backfill
+            '--ingest', dest='ingest', metavar='FILE',
+            help='store the lyrics and covers of a results file made from an --export-missing manifest',
+        )
+        command.parser.add_option( #lyrics in worker processes
+            '-j', '--jobs', dest='jobs', type='int', default=0,
+            help='fetch and parse lyrics in this many processes, the results are stored by this one',
+        )
+        command.parser.add_option( #lyrics on an event loop
+            '--async', dest='asynclyrics',
+            action='store_true', default=None,
+            help='fetch many lyrics at once on an asyncio event loop, see the async: concurrency option',
+        )
+        command.parser.add_option( #a part of the library
+            '--shard', dest='shard', metavar='I/N',
+            help='only process the albums and items of shard I of N (0/4 ... 3/4), by a hash of their ids',
+        )
+        command.parser.add_option( #only the rows added or changed since the last run
+            '--incremental', dest='incremental',
+            action='store_true', default=None,
+            help='only process albums and items added or modified since the last run',
+        )
+        command.parser.add_option(
+            '--full', dest='incremental',
+            action='store_false',
+            help='process every matching album and item, even with incremental: enabled: yes',
+        )
 
         def func(lib, opts, args): #main functionalities of the plugin
 
-            print("\n")
-            print("Please run the command with one of the following options: ")
-            print("-c or --cover for finding the album cover")
-            print("-l or --lyric for finding lyrics")
-            print("-a or --all for finding the cover arts for all releases")
-            print("-p or --print for printing lyrics to command line")
-            print("-w or --write for writing lyrics to a file and creating a word cloud")
-            print("\n\n")
+            if (opts.exportmissing != '-'): #the manifest itself is written to the standard output
+                print("\n")
+                print("Please run the command with one of the following options: ")
+                print("-c or --cover for finding the album cover")
+                print("-l or --lyric for finding lyrics")
+                print("-a or --all for finding the cover arts for all releases")
+                print("-p or --print for printing lyrics to command line")
+                print("-w or --write for writing lyrics to a file and creating a word cloud")
+                print("-e or --embed for writing the cover arts into the audio files")
+                print("\n\n")
+
+            self.bindlibrary(lib)
+
+            if (opts.nocache):
+                self.session.cache.enabled = False
+            if (opts.refresh):
+                self.session.cache.refresh = True
+
+            STATS.enabled = bool(opts.stats or opts.statsfile or self.config['stats'].get(bool)) #off means no timing at all
+            STATS.reset()
+
+            incremental = opts.incremental if opts.incremental is not None else self.watermarks.enabled
+            started = time.time() #the next incremental run starts from here, so rows added during this run are not lost
+            marks = {}
+            self.failed.clear()
          
 
-            if(opts.coverart):
-                self.metadata_retriever(lib, lib.albums(ui.decargs(args))) 
-                print("\n")
+            if (opts.rebuildindex):
+                with STATS.timer('stage.index'):
+                    count = self.index.rebuild(lib.items(dbquery.NotQuery(EmptyQuery('lyrics')))) #SQLite skips the songs without lyrics
+                self._log.info('indexed the lyrics of {0} songs', count)
+
+            if (opts.search):
+                self.search(opts.search, opts.searchlimit)
+
+            self.shard = None
+            if (opts.shard):
+                try:
+                    self.shard = parseshard(opts.shard)
+                except ValueError as exc:
+                    raise ui.UserError(str(exc))
+
+            if (opts.ingest):
+                with STATS.timer('stage.ingest'):
+                    self.ingest(lib, opts.ingest)
+
+            if (opts.exportmissing): #only the manifest is written, nothing is fetched
+                kinds = [kind for kind, enabled in (('art', opts.coverart), ('lyrics', opts.lyrics)) if enabled] or ['art', 'lyrics']
+                with STATS.timer('stage.export'):
+                    self.exportmissing(lib, args, opts.exportmissing, kinds)
+                if (STATS.enabled):
+                    self.reportstats(opts)
+                return
+
+            shardlock = contextlib.ExitStack() #nothing to lock without --shard
+            if (self.shard):
+                try:
+                    shardlock = ShardLock(self.config, self._log, *self.shard).acquire()
+                except RuntimeError as exc:
+                    raise ui.UserError(str(exc))
+
+            with shardlock, self.batch(lib) as writer: #changes are stored in batches, the last batch is stored even if the run is interrupted
+                if (opts.drain):
+                    self.drain(lib)
+
+                albumstages = [stage for stage, enabled in (('art', opts.coverart), ('allreleases', opts.allreleases)) if enabled]
+                if (albumstages): #one query for both album stages, the albums flow from allreleases into the cover downloads
+                    albums = lib.albums(*self.query(lib, args, library.Album, albumstages, incremental)) #from database we reach out to albums table
+                    if (opts.allreleases):
+                        albums = self.releasepipeline(lib, albums)
+
+                    with STATS.timer('stage.albums'):
+                        if (opts.coverart):
+                            self.metadata_retriever(lib, albums)
+                        else:
+                            collections.deque(albums, maxlen=0) #running the generator, nothing is kept
+                    print("\n")
+
+                    for stage in albumstages:
+                        marks[stage] = started
+
+                if (opts.embed or (opts.coverart and self.embed)): #the covers of this run and the ones found before
+                    writer.flush() #the query sees the covers stored by the cover stage
+                    albums = lib.albums(*self.query(lib, args, library.Album, ['embed'], False)) #not incremental, a cover can be found long after the album was added
+                    with STATS.timer('stage.embed'):
+                        self.embedcovers(lib, albums)
+
+                if (opts.lyrics):
+                    itemstages = ['lyrics']
+                else: #-p and -w alone only look at items that have lyrics, each has its own watermark
+                    itemstages = [stage for stage, enabled in (('write', opts.writetofile), ('print', opts.printlyrics)) if enabled]
+                if (not itemstages): #no item stage, the items table is not read at all
+                    items = ()
+                else:
+                    items = lib.items(*self.query(lib, args, library.Item, itemstages, incremental)) #from database we reach out to items table
+                    for stage in itemstages:
+                        marks[stage] = started
+
+                byalbum = opts.byalbum if opts.byalbum is not None else self.config['lyrics_by_album'].get(bool)
+                asynclyrics = opts.asynclyrics if opts.asynclyrics is not None else self.config['async_lyrics'].get(bool)
+                if (opts.lyrics and (byalbum or opts.jobs > 1)): #consecutive songs of the same album and artist are handled together, and sent to a worker process together
+                    batches = (list(group) for key, group in itertools.groupby(items, lambda item: (item.album_id, item.artist)))
+                else:
+                    batches = ([item] for item in items)
 
-            albums = lib.albums(ui.decargs(args)) #from database we reach out to items table
-            for album in albums:
-                if(opts.allreleases):
-                    self.allreleases(lib, album)
+                if (opts.lyrics and opts.jobs > 1): #the batches come out of the worker processes with their lyrics stored
+                    batches = self.lyricsjobs(batches, opts.jobs, byalbum)
+                elif (opts.lyrics and asynclyrics): #or out of the event loop
+                    batches = self.asynclyrics(batches, byalbum)
 
-            items = lib.items(ui.decargs(args)) #from database we reach out to items table
+                self.savedcalls = 0 #Genius API calls saved by the album mode
 
-            for item in items: #for each item in items table
+                for batch in batches: #for each item in items table
 
-                if(opts.lyrics):
-                    self.getlyrics(lib, item) #call getlyrics function 
+                    if(opts.lyrics and opts.jobs <= 1 and not asynclyrics):
+                        with STATS.timer('stage.lyrics'):
+                            if (byalbum):
+                                self.getalbumlyrics(lib, batch)
+                            else:
+                                self.getlyrics(lib, batch[0]) #call getlyrics function 
                 
-                if (item.lyrics): #if the lyrics are found
-                    if (opts.printlyrics): #if there is a -p or --print option
-                        title = item.artist + " - " + item.title
-                        title = ui.colorize('action', title)
-                        ui.print_(title)
-                        ui.print_(item.lyrics) #print lyrics to console
-                        ui.print_("\n") #print a space character after each song
-                    if (opts.writetofile): #if there is a -w or --write option
-                        self.writetofile(lib, item) #writing lyrics to file
+                    for item in batch:
+                        if (item.lyrics): #if the lyrics are found
+                            if (opts.printlyrics): #if there is a -p or --print option
+                                title = item.artist + " - " + item.title
+                                title = ui.colorize('action', title)
+                                ui.print_(title)
+                                ui.print_(item.lyrics) #print lyrics to console
+                                ui.print_("\n") #print a space character after each song
+                            if (opts.writetofile): #if there is a -w or --write option
+                                with STATS.timer('stage.write'):
+                                    self.writetofile(lib, item) #writing lyrics to file
+
+                if (opts.lyrics and byalbum):
+                    self._log.info('searching by album saved {0} Genius API calls', self.savedcalls)
+
+                if (opts.writetofile):
+                    with STATS.timer('stage.wordclouds'):
+                        self.renderclouds(lib)
+
+            for stage in [stage for stage in marks if incremental and self.failed[stage]]: #the rows that failed were not changed, the next run has to find them again
+                self._log.info('{0} {1} requests failed, the next incremental run starts from the same point', self.failed[stage], stage)
+                del marks[stage]
+
+            if (incremental and marks): #after the last batch is stored, an interrupted run keeps the old watermarks
+                self.watermarks.set(lib, marks)
+
+            if (STATS.enabled): #after the last batch is stored, so the store timer is complete
+                self.reportstats(opts)
          
 
         command.func = func #assign our functionalities
         return [command] #our command is working now
 
 
-    def metadata_retriever(self, lib, albums): #Get album cover for each of the albums. This implements the metadata_retriever CLI command.
-        
-        for album in albums:
-            if (album.artpath and os.path.isfile(album.artpath)):
-                message = ui.colorize('action', 'already has cover art')
-                self._log.info('{0}: {1}', album, message)  #prints out to command line 
+    def query(self, lib, args, model, stages, incremental): #(query, sort) of the command line arguments, in incremental mode SQLite also filters the rows the stages have nothing to do with
+
+        query, sort = library.parse_query_parts(ui.decargs(args), model)
+        if (self.shard):
+            query = dbquery.AndQuery([query, ShardQuery('album' if model is library.Album else 'item', *self.shard)])
+        if (not incremental):
+            return query, sort
+
+        fields = ['added'] if model is library.Album else ['added', 'mtime'] #albums have no mtime, items are modified when their tags change
+        readers = set(stages) <= set(['write', 'print']) #the stages that use the stored lyrics also look at the time they were stored
+        parts = [query, changedsince(fields, min(self.watermarks.get(lib, stage) for stage in stages), [LYRICS_STORED] if readers else [])] #the stage that ran longest ago
+
+        if (stages == ['art']): #stages sharing a query only share the time filter
+            parts.append(EmptyQuery('artpath'))
+        elif (stages == ['lyrics']):
+            parts.append(EmptyQuery('lyrics'))
+        elif (readers):
+            parts.append(dbquery.NotQuery(EmptyQuery('lyrics')))
+
+        return dbquery.AndQuery(parts), sort
+
+
+    def exportmissing(self, lib, args, path, kinds): #streams the albums without cover art and the items without lyrics to a manifest, see manifest.py
+
+        import manifest
+
+        with manifest.ManifestWriter(path) as writer:
+            if ('art' in kinds):
+                query, sort = self.query(lib, args, library.Album, ['art'], False) #the arguments and --shard, SQLite keeps only the albums without artpath
+                for album in lib.albums(dbquery.AndQuery([query, EmptyQuery('artpath')]), sort):
+                    if (album.mb_albumid and not self.misses.skip(album, 'art')): #the archive is asked by release id
+                        writer.write(manifest.albumrecord(album))
+
+            if ('lyrics' in kinds):
+                query, sort = self.query(lib, args, library.Item, ['lyrics'], False)
+                for item in lib.items(dbquery.AndQuery([query, EmptyQuery('lyrics')]), sort):
+                    if (not self.misses.skip(item, 'lyrics')):
+                        writer.write(manifest.itemrecord(item))
+
+        STATS.count('manifest.written', writer.count)
+        self._log.info('wrote {0} albums and items to {1}', writer.count, path)
+
+
+    def ingest(self, lib, path): #stores a results file of manifest.py in transactions of ingest_batch results
+
+        import manifest
+
+        size = max(1, self.config['ingest_batch'].get(int))
+        fields = self.misses.fields('lyrics')
+        counts = collections.Counter()
+
+        for chunk in manifest.chunks(manifest.readrecords(path, self._log), size):
+            lyrics = [] #(lyrics, item id) written with one UPDATE each, loading a million items would take hours
+            missing = [] #items and albums whose miss is recorded
+            albums = []
+
+            for record in chunk:
+                if ('error' in record): #the request failed, the next export lists it again
+                    counts['failed'] += 1
+                elif (record['kind'] == 'item' and 'lyrics' in record):
+                    if (record['lyrics']):
+                        lyrics.append((cleanlyrics(record['lyrics']), record['id']))
+                    else:
+                        missing.append(lib.get_item(record['id']))
+                elif (record['kind'] == 'album' and 'image' in record):
+                    album = lib.get_album(record['id'])
+                    if (album is None):
+                        counts['unknown'] += 1
+                    elif (not record['image']):
+                        missing.append(album)
+                    else:
+                        cover = self.ingestcover(album, record['image']) #outside the transaction, copying and resizing take time
+                        if (cover):
+                            album.artpath = cover
+                            self.misses.clear(album, 'art')
+                            albums.append(album)
+
+            stored = time.time()
+            with STATS.timer('store'), lib.transaction() as tx: #the nested transactions of store() join this one
+                for row in lyrics:
+                    tx.mutate('UPDATE items SET lyrics = ? WHERE id = ?', row)
+                    tx.mutate('DELETE FROM item_attributes WHERE entity_id = ? AND key IN (?, ?)', (row[1],) + fields) #the miss memo of the item
+                    tx.mutate('INSERT INTO item_attributes (entity_id, key, value) VALUES (?, ?, ?)', (row[1], LYRICS_STORED, repr(stored))) #the UNIQUE constraint of beets replaces the earlier stamp
+                for obj in missing:
+                    if (obj is not None):
+                        self.misses.record(obj, 'art' if isinstance(obj, library.Album) else 'lyrics')
+                        obj.store()
+                for album in albums:
+                    album.store()
+
+            rows = []
+            for start in range(0, len(lyrics), 500): #SQLite limits the number of parameters of a statement
+                ids = [item_id for text, item_id in lyrics[start:start + 500]]
+                with lib.transaction() as tx:
+                    rows.extend(tx.query('SELECT id, artist, title, lyrics FROM items WHERE id IN ({0})'.format(', '.join('?' * len(ids))), ids))
+            self.index.add([tuple(row) for row in rows])
+
+            counts['lyrics'] += len(rows)
+            counts['unknown'] += len(lyrics) - len(rows) + missing.count(None)
+            counts['missing'] += len(missing) - missing.count(None)
+            counts['covers'] += len(albums)
+            STATS.count('ingested', len(chunk))
+            self._log.debug('ingested {0} results', len(chunk))
+
+        self._log.info('ingested {0} lyrics and {1} covers, {2} not found, {3} failed, {4} not in the library',
+                       counts['lyrics'], counts['covers'], counts['missing'], counts['failed'], counts['unknown'])
+
+
+    def ingestcover(self, album, image): #copies a cover of the results file into the album directory, returns its path or None
+
+        import coverart
+
+        try:
+            with open(image, 'rb') as f:
+                kind = coverart.imagetype(f.read(16))
+        except OSError as exc:
+            self._log.warning('{0}: cannot read {1}: {2}', album, image, exc)
+            return None
+
+        if (kind is None):
+            self._log.warning('{0}: {1} is not an image', album, image)
+            return None
+
+        finalname = os.path.join(util.py3_path(album.path), 'cover.png' if kind == 'image/png' else 'cover.jpg')
+        if (os.path.abspath(image) != os.path.abspath(finalname)):
+            shutil.copyfile(image, finalname + '.part')
+            os.replace(finalname + '.part', finalname) #the old cover stays until the new one is complete
+        self.resize(finalname)
+
+        return finalname
+
+
+    def lyricsjobs(self, batches, jobs, byalbum): #fetches the lyrics of each batch in a worker process and stores them here, the batches are yielded in order
+
+        pool = futures.ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context('spawn'),
+                                           initializer=lyricsworker.start, initargs=(self.config.flatten(), self.lyricclasses(), self.workeroptions()))
+        pending = collections.deque() #(batch, items to fetch, future), at most 2 * jobs of them
+
+        with pool:
+            for batch in batches:
+                todo = [item for item in batch if self.needslyrics(item)] #the database is read only here
+                future = pool.submit(lyricsworker.fetch, [(item.artist, item.title) for item in todo], byalbum) if todo else None
+                pending.append((batch, todo, future))
+
+                if (len(pending) >= 2 * jobs): #keeping the window bounded so that huge libraries do not fill the memory
+                    yield self.storejob(*pending.popleft())
+
+            while (pending):
+                yield self.storejob(*pending.popleft())
+
+
+    def lyricclasses(self): #(name, module, class) of the backends, the worker processes make the same ones
+        return [(name, self.SOURCE_LYRICS[name][0], self.SOURCE_LYRICS[name][1]) for name in self.lyricsources]
+
+
+    def workeroptions(self): #the command line flags of the run that are not in the configuration
+        return {'cache': self.session.cache.enabled, 'refresh': self.session.cache.refresh, 'stats': STATS.enabled}
+
+
+    def storejob(self, batch, todo, future): #the single writer: results of the worker processes are stored on this thread
+
+        if (future is None):
+            return batch
+
+        with STATS.timer('stage.lyrics'):
+            try:
+                results, calls, stats = future.result()
+            except futures.process.BrokenProcessPool as exc:
+                raise ui.UserError('a lyrics worker process died: {0}'.format(exc))
+            STATS.merge(stats) #requests, bytes, cache hits and parsing of the worker
+
+            self.storeresults(todo, results, calls)
+
+        return batch
+
+
+    def storeresults(self, todo, results, calls): #[(lyrics, error)] of the items of a batch, from --jobs or --async
+
+        self.savedcalls += len(todo) - calls
+        for item, (lyrics, error) in zip(todo, results):
+            if (error): #network errors and throttling are not misses, the item is tried again in the next run
+                self._log.warning('{0}: lyrics request failed: {1}', item, error)
+                self.failed['lyrics'] += 1
             else:
-                localpath = [album.path]
+                self.storelyrics(item, lyrics)
 
-                result = self.source[0].get(album, self, localpath)
 
-                if(result):
-                    image = True
-                else:
-                    image = None
+    def asynclyrics(self, batches, byalbum): #fetches the lyrics of many batches at once on an asyncio event loop, the batches are yielded in order with their lyrics stored
+
+        from asyncengine import LyricsEngine
+
+        engine = LyricsEngine(self.resolver, self.config, self._log)
+        self.session.poolsize(engine.concurrency) #a connection for each request in flight, none is discarded after use
+        return engine.run(batches, self.needslyrics, self.storeresults, byalbum) #storeresults runs on this thread, in the writer coroutine
+
+
+    def search(self, phrase, limit=None): #prints the best matches of the lyrics index
+
+        with STATS.timer('search'):
+            results = self.index.search(phrase, limit)
+
+        if (not results and self.index.empty()): #only checked when nothing matched, the search itself stays the only query
+            self._log.warning('the lyrics index is empty, run "beet metadata_retriever --rebuild-index" first')
+            return
+
+        for item_id, artist, title, snippet in results:
+            ui.print_(ui.colorize('action', '{0} - {1}'.format(artist, title)) + ' (id:{0})'.format(item_id))
+            ui.print_('    ' + ' / '.join(line.strip() for line in snippet.splitlines() if line.strip())) #the lines of the snippet on one line
+
+        if (not results):
+            ui.print_('no lyrics contain "{0}"'.format(phrase))
+
+
+    def releasepipeline(self, lib, albums): #runs allreleases on each album and passes it on to the cover stage
+
+        for album in albums:
+            with STATS.timer('stage.allreleases'):
+                self.allreleases(lib, album)
+            yield album
+
+
+    def reportstats(self, opts): #summary of the counters and timers, and the export file
+
+        if (opts.stats or not opts.statsfile):
+            ui.print_(ui.colorize('action', 'statistics'))
+            for line in STATS.report():
+                ui.print_(line)
+
+        if (opts.statsfile):
+            text = STATS.prometheus() if opts.statsformat == 'prometheus' else STATS.json()
+            with open(opts.statsfile, 'w') as f:
+                f.write(text)
+
+
+    def imported(self, lib, album): #album_imported listener, beets sends it once the files of the album are in their final place
+        self.bindlibrary(lib)
+        if (self.config['background'].get(bool)): #the import goes on without waiting for the network
+            self.queue.put(album.id)
+            self.startworker(lib)
+        else:
+            with self.batch(lib):
+                self.metadata_retriever(lib, [album])
+                if (self.embed):
+                    self.embedcovers(lib, [album])
+
+
+    def bindlibrary(self, lib): #the stores keyed by item and album ids open the file of this library
+        for store in (self.index, self.words, self.queue):
+            store.bind(lib)
+
+
+    def startworker(self, lib): #starts the background thread on the first queued album, later ones only wake it up
+        self.wakeup.set()
+        if (self.worker is None or not self.worker.is_alive()):
+            self.worker = threading.Thread(target=self.background, args=(lib,))
+            self.worker.daemon = True #never keeps beets running, the queue is persistent anyway
+            self.worker.start()
+
+
+    def background(self, lib): #body of the background thread
+        while (not self.stopping):
+            self.wakeup.wait()
+            self.wakeup.clear()
+            self.drain(lib)
 
-                if (image): #if the album art is found
-                    album.store() #storing the changes in the database 
-                    message = ui.colorize('text_success', 'found cover art') #print in green
+
+    def stopworker(self, lib): #cli_exit listener, the batch in progress is finished and the rest stays queued
+        if (self.worker is None):
+            return
+
+        self.stopping = True
+        self.wakeup.set()
+        self.worker.join()
+
+        left = len(self.queue)
+        if (left):
+            self._log.info('{0} albums are still queued, run "beet metadata_retriever --drain" to fetch them', left)
+
+
+    def drain(self, lib): #fetches the queued albums batch by batch, an album leaves the queue only after its results are stored
+        lyrics = self.config['background_lyrics'].get(bool)
+        byalbum = self.config['lyrics_by_album'].get(bool)
+
+        while (True):
+            album_ids = self.queue.peek()
+            if (not album_ids):
+                break
+
+            albums = [lib.get_album(album_id) for album_id in album_ids]
+            albums = [album for album in albums if album] #albums removed from the library since they were queued
+
+            with self.batch(lib) as writer:
+                self.metadata_retriever(lib, albums)
+                if (self.embed):
+                    self.embedcovers(lib, albums)
+
+                if (lyrics):
+                    for album in albums:
+                        items = list(album.items())
+                        if (byalbum):
+                            self.getalbumlyrics(lib, items)
+                        else:
+                            for item in items:
+                                self.getlyrics(lib, item)
+
+                writer.flush() #the results are stored before the albums leave the queue, also when --drain runs inside a bigger batch
+
+            self.queue.done(album_ids)
+
+            if (self.stopping and threading.current_thread() is self.worker): #the import is over, the rest waits for --drain
+                break
+
+
+    @contextlib.contextmanager
+    def batch(self, lib): #the outermost call on a thread creates its BatchWriter, nested calls reuse it
+        if (getattr(self.local, 'writer', None) is not None):
+            yield self.local.writer
+            return
+
+        try:
+            with BatchWriter(lib, self.config['batch_size'].get(int), self._log) as writer:
+                self.local.writer = writer
+                yield writer
+        finally:
+            self.local.writer = None
+            self.index.flush() #the index and the word counts are committed together with the last batch
+            self.words.flush()
+
+
+    def store(self, obj): #stores through the BatchWriter of this thread, directly outside of batch()
+        writer = getattr(self.local, 'writer', None)
+        if (writer is not None):
+            writer.store(obj)
+        else:
+            obj.store()
+
+
+    def metadata_retriever(self, lib, albums): #Get album cover for each of the albums. This implements the metadata_retriever CLI command.
+
+        #covers are downloaded by a pool of threads, but the results are stored and logged here on the main thread in the order of the albums
+        pending = collections.deque() #(album, state, future) triples waiting to be stored, at most 2 * workers of them
+
+        with futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for album in albums:
+                future = None #nothing to download for the first two states, the window keeps the log order anyway
+
+                if (album.artpath and os.path.isfile(album.artpath)):
+                    state = 'exists'
+                elif (self.misses.skip(album, 'art')): #not found in an earlier run, waiting for the retry date
+                    state = 'skipped'
                 else:
-                    message = ui.colorize('text_error', 'cover art not found') #print in red
-                    
-                self._log.info('{0}: {1}', album, message) #prints out to command line
+                    state = 'fetch'
+                    localpath = [album.path] #read here, database access is kept on the main thread
+                    future = executor.submit(self.fetchcover, album, localpath)
+
+                pending.append((album, state, future))
+
+                if (len(pending) >= 2 * self.workers): #keeping the window bounded so that huge libraries do not fill the memory
+                    self.storecover(*pending.popleft())
+
+            while (pending):
+                self.storecover(*pending.popleft())
+
+
+    def embedcovers(self, lib, albums): #writes the cover of each album into its files in the process pool, one job per album
+
+        import embedart #its function is sent to the pool, mediafile and Pillow are imported only in the worker processes
+
+        pending = collections.deque() #(items, future), at most 2 * workers albums
+        counts = collections.Counter()
+
+        for album in albums:
+            if (not album.artpath or not os.path.isfile(album.artpath)): #nothing fetched yet
+                continue
+
+            stamp = '{0}:{1}'.format(embedart.filedigest(util.syspath(album.artpath)), self.maxwidth) #the cover and the size it is embedded at
+            if (album.get(embedart.EMBEDDED) == stamp): #its files were written with this cover before, none of them is opened
+                counts['skipped'] += 1
+                STATS.count('embed.skipped')
+                continue
+
+            items = list(album.items())
+            future = self.processpool().submit(embedart.embed, util.syspath(album.artpath), [util.syspath(item.path) for item in items], self.maxwidth)
+            pending.append((album, items, stamp, future))
+
+            if (len(pending) >= 2 * self.workers): #keeping the window bounded so that huge libraries do not fill the memory
+                self.storeembedded(counts, *pending.popleft())
+
+        while (pending):
+            self.storeembedded(counts, *pending.popleft())
+
+        if (counts):
+            self._log.info('embedded cover art into {0} files, {1} already had it, {2} failed, {3} albums unchanged since the last run',
+                           counts['embedded'], counts['unchanged'], counts['failed'], counts['skipped'])
+
+
+    def storeembedded(self, counts, album, items, stamp, future): #runs on the main thread, the new modification times of the written files are stored
+
+        import embedart
+
+        try:
+            with STATS.timer('embed'):
+                results = future.result()
+        except (OSError, futures.process.BrokenProcessPool) as exc: #the cover could not be read, the files are left as they were
+            self._log.warning('{0}: could not embed {1}: {2}', album, util.displayable_path(album.artpath), exc)
+            counts['failed'] += len(items)
+            return
+
+        failed = False
+        for item in items:
+            result = results[util.syspath(item.path)]
+            if (result == 'embedded'):
+                item.mtime = item.current_mtime() #like Item.write, the file is not seen as modified outside beets
+                self.store(item)
+            elif (result != 'unchanged'):
+                self._log.warning('{0}: could not embed cover art: {1}', item, result)
+                result = 'failed'
+                failed = True
+            counts[result] += 1
+            STATS.count('embed.' + result)
+
+        if (not failed): #an album with a failed file is tried again in the next run
+            album[embedart.EMBEDDED] = stamp
+            self.store(album)
+
+
+    def fetchcover(self, album, localpath): #runs on a worker thread, does only the network part and never touches the database
+
+        path = self.source[0].get(album, self, localpath) #path of the cover or None
+
+        if (path):
+            self.resize(path)
+
+        return path
+
+
+    def resize(self, path): #makes the cover at most maxwidth wide in a worker process, the calling thread waits for it
+
+        if (not self.maxwidth):
+            return
+
+        import artresize #its function is sent to the pool, Pillow itself is imported only in the worker processes
+
+        try:
+            with STATS.timer('resize'):
+                if (self.processpool().submit(artresize.resize, path, self.maxwidth).result()):
+                    STATS.count('resized')
+        except (OSError, futures.process.BrokenProcessPool) as exc: #the cover is kept as it was downloaded
+            self._log.warning('could not resize {0}: {1}', path, exc)
+
+
+    def processpool(self):
+        with self.processlock:
+            if (self.processes is None): #spawn, because forking a process that runs download threads can copy held locks
+                self.processes = futures.ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+            return self.processes
+
+
+    def stopprocesses(self, lib=None): #cli_exit listener
+        with self.processlock:
+            if (self.processes is not None):
+                self.processes.shutdown()
+                self.processes = None
+
+
+    def closestores(self, lib=None): #cli_exit listener, after the background worker has stopped; the pending changes of the stores are written
+        if (self._session is not None):
+            self._session.close()
+        for store in (self.index, self.words, self.queue):
+            store.close()
+
+
+    def storecover(self, album, state, future): #runs on the main thread, database writes happen only here
+
+        import requests #loaded by the session already
+
+        if (state == 'exists'):
+            message = ui.colorize('action', 'already has cover art')
+        elif (state == 'skipped'):
+            message = ui.colorize('text_highlight', 'cover art not found before, retrying after {0}'.format(self.misses.retrydate(album, 'art')))
+        else:
+            try:
+                result = future.result() #waits for the download of this album
+            except requests.RequestException as exc: #network errors are not recorded as misses, the album is tried again in the next run
+                self._log.debug('request failed: {0}', exc)
+                self.failed['art'] += 1
+                result = False
+
+            if (result): #if the album art is found
+                album.artpath = result
+                self.misses.clear(album, 'art')
+                self.store(album) #storing the changes in the database 
+                message = ui.colorize('text_success', 'found cover art') #print in green
+            elif (result is None): #the archive has no cover for this album
+                self.misses.record(album, 'art')
+                self.store(album)
+                message = ui.colorize('text_error', 'cover art not found') #print in red
+            else:
+                message = ui.colorize('text_error', 'cover art request failed')
+
+        self._log.info('{0}: {1}', album, message) #prints out to command line
    
 
     def getlyrics(self, lib, item): #get lyrics from web and store them in the database
 
+        if (not self.needslyrics(item)):
+            return
+
+        import requests #loaded by the session already
+
+        try:
+            lyrics = self.resolver.fetch(item.artist, item.title) #the backends in order, see LyricsResolver
+        except requests.RequestException as exc: #network errors and throttling are not misses, the item is tried again in the next run
+            self._log.warning('{0}: lyrics request failed: {1}', item, exc)
+            self.failed['lyrics'] += 1
+            return
+
+        self.storelyrics(item, lyrics)
+
+    def getalbumlyrics(self, lib, items): #same as getlyrics for the songs of one album by one artist
+
+        items = [item for item in items if self.needslyrics(item)]
+        if (not items):
+            return
+
+        import requests #loaded by the session already
+
+        name, backend = self.resolver.first()
+        if (len(items) == 1 or not hasattr(backend, 'fetchalbum')): #nothing to share
+            for item in items:
+                self.getlyrics(lib, item)
+            return
+
+        try:
+            results, calls = self.resolver.call(name, 'fetchalbum', items[0].artist, [item.title for item in items])
+        except requests.RequestException as exc: #the album is tried again in the next run
+            self._log.warning('{0}: lyrics request failed: {1}', items[0].album, exc)
+            self.failed['lyrics'] += len(items)
+            return
+
+        self.savedcalls += len(items) - calls #one search per song without the album mode
+        self._log.debug('{0}: {1} API calls for {2} songs', items[0].album, calls, len(items))
+
+        for item, lyrics in zip(items, results):
+            if (not lyrics and len(self.backends) > 1): #the other backends, song by song
+                try:
+                    lyrics = self.resolver.fetch(item.artist, item.title, skip=[name])
+                except requests.RequestException as exc:
+                    self._log.warning('{0}: lyrics request failed: {1}', item, exc)
+                    self.failed['lyrics'] += 1
+                    continue
+            self.storelyrics(item, lyrics)
+
+    def needslyrics(self, item): #False if the item has lyrics or is waiting for its retry date
+
         if (item.lyrics): #if lyrics already exists
             message = ui.colorize('text_highlight', 'lyrics already exist')    
             self._log.info('{0}: {1}', message, item)  #prints out to command line 
-            return
+            return False
         
-        lyrics = self.backends[0].fetch(item.artist, item.title) #call fetch function defined in Genius class
+        if (self.misses.skip(item, 'lyrics')): #not found in an earlier run, waiting for the retry date
+            message = ui.colorize('text_highlight', 'lyrics not found before, retrying after {0}'.format(self.misses.retrydate(item, 'lyrics')))
+            self._log.info('{0}: {1}', message, item)
+            return False
+
+        return True
 
+    def storelyrics(self, item, lyrics):
 
         if (lyrics): #if we find the lyrics
             message = ui.colorize('text_success', 'fetched lyrics')    
@@ -169,17 +1026,19 @@ class metadata_retriever(BeetsPlugin): #derived from BeetsPlugin and RequestLogg
         else: #if lyrics not found
             message = ui.colorize('text_error', 'lyrics not found')    
             self._log.info('{0}: {1}', message, item)  #prints out to command line 
-            default_lyrics = None #default_lyrics value is defined as None
-            lyrics = default_lyrics
+            self.misses.record(item, 'lyrics') #the item is skipped until its retry date
+            self.store(item)
+            return
            
-        item.lyrics = lyrics.strip() #assign lyrics to item's lyrics deleting whitespaces at the beginning and at the end of the text
-        item.lyrics = re.sub(r"[\(\[].*?[\)\]]", "", item.lyrics)
-        item.store() #store item in the database
+        item.lyrics = cleanlyrics(lyrics) #assign lyrics to item's lyrics deleting whitespaces at the beginning and at the end of the text
+        item[LYRICS_STORED] = time.time() #incremental -w and -p runs find the item again
+        self.misses.clear(item, 'lyrics')
+        self.store(item) #store item in the database
+        self.index.update(item) #the search index follows the stored lyrics
 
     def writetofile(self, lib, item):
 
-        save_path = '/Users/dilanuslan/Desktop/NewMusic/'  #the constant part of the path
-        save_path = save_path + item.albumartist + '/' + item.album #the artist name and the album name is added to the path 
+        save_path = os.path.dirname(util.py3_path(item.path)) #the directory of the song
         filename = item.title + ".txt"  #the name of the file will be the song name
 
         finalname = os.path.join(save_path, filename) #adding filename to the path
@@ -192,39 +1051,44 @@ class metadata_retriever(BeetsPlugin): #derived from BeetsPlugin and RequestLogg
         lyricsfile.close() #closing the file
 
         #this part was inspired from: https://github.com/kvsingh/lyrics-sentiment-analysis/blob/master/wordclouds.py
+        #the words are counted here, the clouds are drawn once per artist and album by renderclouds() at the end of the run
 
-        words = ''
+        with STATS.timer('wordcounts'):
+            self.words.update(item)
 
-        f = open(finalname, "rb")
-        for s in f.readlines():
-            sentence = s.decode('utf-8')
-            #converted Turkish characters to English for a better visual
-            sentence = re.sub('İ', 'I', sentence) 
-            sentence = re.sub('Ş', 'S', sentence)
-            sentence = re.sub('Ç', 'C', sentence)
-            sentence = re.sub('Ö', 'O', sentence)
-            words += sentence
 
+    def renderclouds(self, lib): #draws the clouds changed in this run in the process pool, each one once
 
-        word_cloud = WordCloud(width=1000, height=500).generate(words.lower())
+        save_path2 = os.path.join(util.py3_path(lib.directory), 'wordclouds') #wordclouds directory in the music directory
+        jobs = []
 
-        save_path2 = '/Users/dilanuslan/Desktop/NewMusic/wordclouds/' 
-        filename2 = item.albumartist + ".png"
-        finalname2 = os.path.join(save_path2, filename2)  
-      
-        word_cloud.to_file(finalname2)
-        image = word_cloud.to_image()
+        for kind, name in self.words.pending():
+            frequencies = self.words.frequencies(kind, name)
+            if (not frequencies): #the lyrics of the last song were removed
+                continue
 
-        f.close()
+            directory = save_path2 if kind == 'artist' else os.path.join(save_path2, 'albums')
+            if (not os.path.isdir(directory)):
+                os.makedirs(directory)
+
+            finalname2 = os.path.join(directory, wordfreq.filename(name))
+            jobs.append(self.processpool().submit(wordfreq.render, frequencies, finalname2, self.words.width, self.words.height))
+
+        for job in jobs:
+            try:
+                self._log.debug('word cloud: {0}', job.result())
+                STATS.count('wordclouds.rendered')
+            except (OSError, ValueError, futures.process.BrokenProcessPool) as exc:
+                self._log.warning('could not draw a word cloud: {0}', exc)
 
 
     def allreleases(self, lib, album):
 
-        musicbrainzngs.set_useragent("beets.io", "0.1", "beets.io")
-        URL = 'https://coverartarchive.org/release/'
+        import musicbrainzngs #this library is used to reach Musicbrainz API directly to find all releases
+        import requests #loaded by the session already
 
-        save_path = '/Users/dilanuslan/Desktop/NewMusic/'  #the constant part of the path
-        save_path = save_path + album.albumartist + '/' + album.album #the artist name and the album name is added to the path 
+        musicbrainzngs.set_useragent("beets.io", "0.1", "beets.io")
+        save_path = util.py3_path(album.path) #the directory of the album
 
         message = "Checking all releases for {0}".format(album.album)
 
@@ -234,7 +1098,18 @@ class metadata_retriever(BeetsPlugin): #derived from BeetsPlugin and RequestLogg
 
         idlist = []
 
-        release_group_dict = musicbrainzngs.get_release_group_by_id(album.mb_releasegroupid, includes=["releases"])
+        cache_url = 'musicbrainz:release-group/{0}?inc=releases'.format(album.mb_releasegroupid) #musicbrainzngs does not show its urls, so the cache key is made here
+        release_group_dict = self.session.cache.get_json('musicbrainz', cache_url)
+
+        if (release_group_dict is None):
+            try: #musicbrainzngs makes its own requests, they go through the limiter of the MusicBrainz host
+                release_group_dict = self.session.throttle.call(musicbrainzngs.musicbrainz.hostname,
+                    lambda: musicbrainzngs.get_release_group_by_id(album.mb_releasegroupid, includes=["releases"]), self.musicbrainzretry)
+            except (musicbrainzngs.WebServiceError, requests.RequestException) as exc: #the album is tried again in the next run
+                self._log.warning('{0}: release group lookup failed: {1}', album, exc)
+                self.failed['allreleases'] += 1
+                return
+            self.session.cache.set_json('musicbrainz', cache_url, release_group_dict)
 
         base_key = 'release-count'
 
@@ -252,28 +1127,115 @@ class metadata_retriever(BeetsPlugin): #derived from BeetsPlugin and RequestLogg
                             idlist.append(releaseid)
 
 
-        ##this block makes a query for each id in the list, if the response turns ok the cover is downloaded to a file in the album's directory.
+        ##this block downloads the cover of each release in parallel, byte-identical covers are stored once
 
-        for i in range(0, len(idlist)):
-            filename = "cover{}.jpg".format(i+1)  
+        manifest = self.readmanifest(save_path) #covers of the earlier runs, so an interrupted album continues where it stopped
+        pending = []
 
-            finalname = os.path.join(save_path, filename) #adding filename to the path
+        with futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for i in range(0, len(idlist)):
+                filename = "cover{}.jpg".format(i+1)  
 
-            if(os.path.exists(finalname)):
-                return 
-            else:
+                finalname = os.path.join(save_path, filename) #adding filename to the path
+
+                entry = manifest['releases'].get(idlist[i])
+                if (entry and os.path.exists(os.path.join(save_path, entry['file']))): #this release is done
+                    continue
+
+                if (os.path.exists(finalname)): #downloaded by an older version of the plugin, only its hash is missing
+                    self.addcover(manifest, save_path, idlist[i], finalname, self.hashfile(finalname))
+                    continue
+
+                pic_urls = self.source[0].urls(idlist[i]) #the thumbnail of maxwidth, then the original
+                pending.append((idlist[i], finalname, executor.submit(self.fetchrelease, pic_urls, finalname)))
+
+            for releaseid, finalname, future in pending: #in release order, so the numbering and the manifest do not depend on timing
+                try:
+                    result = future.result()
+                except requests.RequestException as exc:
+                    self._log.debug('request failed: {0}', exc)
+                    self.failed['allreleases'] += 1
+                    result = None
+
+                if (result): #sha1 of the content
+                    self.addcover(manifest, save_path, releaseid, finalname, result, downloaded=True)
+
+        self.writemanifest(save_path, manifest)
+
+
+    def musicbrainzretry(self, exc): #(retry, Retry-After seconds) of a musicbrainzngs error, see Throttle.call
+        import musicbrainzngs
+        from throttle import retryafter
+
+        if (isinstance(exc, musicbrainzngs.NetworkError)):
+            return True, None
+
+        cause = getattr(exc, 'cause', None)
+        code = getattr(cause, 'code', None)
+        if (isinstance(exc, musicbrainzngs.ResponseError) and code in (429, 503)): #MusicBrainz answers 503 when its rate limit is exceeded
+            return True, retryafter(cause.headers.get('Retry-After')) or 0.0
+        if (isinstance(exc, musicbrainzngs.ResponseError) and code and code >= 500):
+            return True, None
+
+        return False, None
 
-                pic_url = "http://coverartarchive.org/release/{}/front".format(idlist[i])
 
-                with open(finalname, 'wb') as cover:
-                    response = requests.get(pic_url, stream=True)
+    def fetchrelease(self, pic_urls, finalname): #runs on a worker thread, returns the sha1 of the downloaded cover or None
 
-                    if not response.ok:
-                        os.remove(finalname)
+        import coverart
 
-                    for block in response.iter_content(1024):
-                        if not block:
-                            break
+        host = urlsplit(pic_urls[0]).netloc
+        with self.hostlimits[host]: #at most per_host downloads from the same host
+            sha1 = self.source[0].downloader.fetch(pic_urls, finalname, validate=coverart.isimage) #hashed while it streams, a partial file of an interrupted run is continued
 
-                        cover.write(block)
+        if (sha1 is not None):
+            self.resize(finalname) #the hash is of the downloaded image, the same image gives the same smaller copy
+
+        return sha1
+
+
+    def addcover(self, manifest, save_path, releaseid, finalname, sha1, downloaded=False): #stores a cover once, duplicates point to the first copy
+
+        first = manifest['files'].get(sha1)
+        if (first and os.path.exists(os.path.join(save_path, first))): #the same image was stored for an earlier release
+            STATS.count('allreleases.duplicates')
+            if (downloaded):
+                os.remove(finalname)
+            if (self.config['allreleases_links'].get(bool) and not os.path.exists(finalname)):
+                try:
+                    os.link(os.path.join(save_path, first), finalname) #the file name exists but the image is on the disk once
+                    first = os.path.basename(finalname)
+                except (OSError, AttributeError): #no hardlinks on this file system, the manifest is enough
+                    pass
+            manifest['releases'][releaseid] = {'file': first, 'sha1': sha1}
+            return
+
+        STATS.count('allreleases.stored')
+        manifest['files'][sha1] = os.path.basename(finalname)
+        manifest['releases'][releaseid] = {'file': os.path.basename(finalname), 'sha1': sha1}
+
+
+    def hashfile(self, path):
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(64 * 1024), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+
+    def readmanifest(self, save_path): #covers.json in the album directory: release id -> file and sha1, sha1 -> file
+        try:
+            with open(os.path.join(save_path, 'covers.json')) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {'releases': {}, 'files': {}}
+
+
+    def writemanifest(self, save_path, manifest):
+        if (not manifest['releases']):
+            return
+        temporary = os.path.join(save_path, 'covers.json.part')
+        with open(temporary, 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        os.replace(temporary, os.path.join(save_path, 'covers.json')) #never a half written manifest
 
@@ -0,0 +1,50 @@
+import time #retry dates are unix timestamps
+
+from stats import STATS #counters of --stats
+
+
+DAY = 24 * 60 * 60 #in seconds
+
+
+class MissMemo(): #remembers the albums and items whose cover art or lyrics were not found, in flexible attributes of the object
+
+    def __init__(self, config, log):
+        self._log = log
+
+        config.add({ #default values, overridden by config.yaml
+            'retry_after': [1, 7, 30, 90], #in days, the nth miss in a row waits for the nth value, the last one is repeated
+            'force': False, #ignore the recorded misses and try everything again
+        })
+
+        self.schedule = [float(days) * DAY for days in config['retry_after'].get(list)]
+        self.force = config['force'].get(bool)
+
+    def fields(self, kind): #kind is 'art' or 'lyrics'
+        return 'mr_{0}_misses'.format(kind), 'mr_{0}_retry'.format(kind)
+
+    def skip(self, obj, kind): #True while the object is waiting for its next retry
+        if (self.force):
+            return False
+
+        retry = obj.get(self.fields(kind)[1])
+        if (retry and float(retry) > time.time()):
+            STATS.count('skipped.' + kind)
+            return True
+        return False
+
+    def retrydate(self, obj, kind): #for the log messages
+        return time.strftime('%Y-%m-%d', time.localtime(float(obj.get(self.fields(kind)[1]))))
+
+    def record(self, obj, kind): #the caller stores the object
+        misses, retry = self.fields(kind)
+        count = int(obj.get(misses, 0)) + 1
+        wait = self.schedule[min(count, len(self.schedule)) - 1] if self.schedule else 0
+
+        obj[misses] = count
+        obj[retry] = time.time() + wait
+        STATS.count('misses.' + kind)
+
+    def clear(self, obj, kind): #called when the cover art or the lyrics are found
+        for field in self.fields(kind):
+            if (field in obj):
+                del obj[field]
@@ -0,0 +1,105 @@
+import re #regular expressions
+import difflib #fuzzy matching of artist names
+import functools #lru_cache
+
+from unidecode import unidecode #takes Unicode data and tries to represent it in ASCII characters
+
+from stats import STATS #counters of --stats
+
+
+BRACKETS = re.compile(r"[\(\[].*?[\)\]]") #(Live), [Remastered]...
+FEATURING = re.compile(r"\s+(?:feat\.|ft\.|featuring)\s.*$", re.IGNORECASE) #the guest artists of a song
+NONWORD = re.compile(r'\W+')
+DIGITS = re.compile(r'\d+')
+
+
+@functools.lru_cache(maxsize=16384) #the same artists and titles come again and again, the cache is bounded so huge libraries do not fill the memory
+def slugify(text):
+    #The unicode module exports a function that takes a string and returns a string that can be encoded to ASCII bytes in Python 3
+    return NONWORD.sub('-', unidecode(text).lower().strip()).strip('-') #we lower unicoded text and remove spaces at the beginning and end of the string, sub replaces \W+ characters in this text with -. Then we remove -'s.
+
+
+@functools.lru_cache(maxsize=16384)
+def artistname(artist): #the artist to search for, without the guests of the song
+    return FEATURING.sub('', artist.split("feat.")[0]).strip() or artist
+
+
+@functools.lru_cache(maxsize=16384)
+def artistkey(artist): #"The Beatles" and "Beatles", "Simon & Garfunkel" and "Simon and Garfunkel" get the same key
+    key = slugify(artistname(artist))
+    if (key.startswith('the-') and key != 'the-the'): #"The The" is not "The"
+        key = key[4:]
+    return key.replace('-and-', '-')
+
+
+@functools.lru_cache(maxsize=16384)
+def titlename(title): #the title to search for
+    return BRACKETS.sub("", title)
+
+
+@functools.lru_cache(maxsize=16384)
+def titlekey(title):
+    return slugify(titlename(title))
+
+
+EXACT, ALIAS, FUZZY = 3, 2, 1 #how sure a match is, see ArtistMatcher.rank
+
+
+class ArtistMatcher(): #matches the artists of the search hits against an artist of the library, with its aliases
+
+    def __init__(self, config):
+        config.add({ #default values, overridden by config.yaml
+            'artist_aliases': {}, #artist: [other names used on Genius]
+            'fuzzy_match': 0, #similarity of two artist keys that are taken as the same artist, like 0.95; 0 turns it off, Weeknd and Weekend are 0.92
+        })
+
+        self.threshold = config['fuzzy_match'].as_number()
+        self.aliases = {} #artist key -> keys of its other names
+
+        for artist, names in (config['artist_aliases'].get(dict) or {}).items():
+            names = [names] if isinstance(names, str) else names
+            keys = set(artistkey(name) for name in [artist] + list(names))
+            for key in keys: #an alias works in both directions
+                self.aliases.setdefault(key, set()).update(keys - set([key]))
+
+    def match(self, artist, hit): #True if hit, an artist name from Genius, is artist
+        return self.rank(artist, hit) > 0
+
+    def rank(self, artist, hit): #EXACT, ALIAS, FUZZY or 0
+        key = artistkey(artist)
+        other = artistkey(hit)
+
+        if (key == other):
+            return EXACT
+        if (other in self.aliases.get(key, ())):
+            return ALIAS
+        if (self.fuzzy(key, other)):
+            return FUZZY
+        return 0
+
+    def best(self, artist, hits, name): #the hit whose artist matches best, the first one among equals; name(hit) is the artist of a hit
+        best, found = None, 0
+        for hit in hits:
+            rank = self.rank(artist, name(hit))
+            if (rank > found):
+                best, found = hit, rank
+                if (rank == EXACT): #nothing can beat it
+                    break
+
+        if (found == ALIAS):
+            STATS.count('match.alias')
+        elif (found == FUZZY):
+            STATS.count('match.fuzzy')
+        return best
+
+    def fuzzy(self, key, other): #spelling differences, never different numbers: "Blink-182" is not "Blink-183"
+        if (not self.threshold or len(key) < 4 or DIGITS.findall(key) != DIGITS.findall(other)):
+            return False
+        if (key.startswith(other) or other.startswith(key)): #Queen and Queens, Future and Futures are other artists, not typos
+            return False
+        return similarity(key, other) >= self.threshold
+
+
+@functools.lru_cache(maxsize=16384)
+def similarity(key, other):
+    return difflib.SequenceMatcher(None, key, other).ratio()
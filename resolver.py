@@ -0,0 +1,124 @@
+import time #latency of the backends
+import threading #the statistics are updated by the hedging threads
+from concurrent import futures #the backends run on threads so that a slow one can be overtaken
+
+from stats import STATS #counters of --stats
+
+
+class BackendRecord(): #what a lyrics backend did in this run
+
+    def __init__(self, name, priority):
+        self.name = name
+        self.priority = priority #position in the lyric list of the configuration
+        self.calls = 0
+        self.hits = 0
+        self.errors = 0
+        self.latency = None #moving average in seconds
+
+    def hitrate(self): #smoothed, so one lucky call does not move a backend to the front
+        return (self.hits + 1.0) / (self.calls + 2.0)
+
+    def add(self, seconds, hit, error):
+        self.calls += 1
+        self.hits += 1 if hit else 0
+        self.errors += 1 if error else 0
+        self.latency = seconds if self.latency is None else 0.8 * self.latency + 0.2 * seconds
+
+
+class LyricsResolver(): #asks the lyrics backends in order, a backend that is slow to answer gets a hedged request to the next one
+
+    def __init__(self, names, backends, config, log):
+        self._log = log
+
+        config.add({ #default values, overridden by config.yaml
+            'hedge_delay': 2.0, #seconds to wait for a backend before the next one is asked too
+            'adaptive_order': True, #backends with more hits and less latency move to the front during a run
+            'adaptive_after': 20, #calls of every backend before the order changes
+        })
+
+        self.delay = config['hedge_delay'].as_number()
+        self.adaptive = config['adaptive_order'].get(bool)
+        self.after = config['adaptive_after'].get(int)
+
+        self.backends = dict(zip(names, backends))
+        self.records = [BackendRecord(name, i) for i, name in enumerate(names)]
+        self.lock = threading.Lock()
+        self.executor = None #made on the first hedged call, one backend alone is called directly
+
+    def order(self): #names of the backends, the best first
+        with self.lock:
+            records = list(self.records)
+            if (self.adaptive and all(record.calls >= self.after for record in records)):
+                records.sort(key=lambda record: (-record.hitrate(), record.latency, record.priority))
+            return [record.name for record in records]
+
+    def first(self):
+        name = self.order()[0]
+        return name, self.backends[name]
+
+    def call(self, name, method, *args): #runs one backend and records its answer
+        start = time.perf_counter()
+        try:
+            result = getattr(self.backends[name], method)(*args)
+        except Exception:
+            self.record(name, time.perf_counter() - start, False, True)
+            raise
+        self.record(name, time.perf_counter() - start, bool(result), False)
+        return result
+
+    def record(self, name, seconds, hit, error):
+        with self.lock:
+            for record in self.records:
+                if (record.name == name):
+                    record.add(seconds, hit, error)
+        STATS.addtime('lyrics_backend.' + name, seconds)
+        STATS.count(('lyrics_hits.' if hit else 'lyrics_errors.' if error else 'lyrics_misses.') + name)
+
+    def fetch(self, artist, title, skip=()): #the first lyrics found, None if no backend has them; raises the last error if every backend failed
+        names = [name for name in self.order() if name not in skip]
+        if (not names):
+            return None
+        if (len(names) == 1):
+            return self.call(names[0], 'fetch', artist, title)
+
+        with self.lock:
+            if (self.executor is None):
+                self.executor = futures.ThreadPoolExecutor(max_workers=4 * len(self.backends))
+
+        running = {}
+        error = None
+        waiting = list(names)
+
+        try:
+            while (waiting or running):
+                if (waiting): #the first backend, the next one after a miss or an error, or a hedge
+                    name = waiting.pop(0)
+                    running[self.executor.submit(self.call, name, 'fetch', artist, title)] = name
+
+                done, _ = futures.wait(running, timeout=self.delay if waiting else None, return_when=futures.FIRST_COMPLETED)
+                if (not done): #the backends asked so far are slow, the next one is asked too
+                    STATS.count('lyrics_hedged')
+                    continue
+
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        lyrics = future.result()
+                    except Exception as exc: #the next backend may have them
+                        self._log.debug('{0} failed: {1}', name, exc)
+                        error = exc
+                        continue
+                    if (lyrics):
+                        return lyrics
+
+                if (not running and not waiting and error is not None):
+                    raise error
+        finally:
+            for future in running: #answers that come later are thrown away, requests that have not started are cancelled
+                future.cancel()
+
+        return None
+
+    def close(self):
+        if (self.executor is not None):
+            self.executor.shutdown(wait=False)
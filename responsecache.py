@@ -0,0 +1,141 @@
+import json #JavaScript Object Notation
+import time #expiry dates are unix timestamps
+import hashlib #cache keys are hashes of the normalized requests
+
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode #for normalizing the urls
+
+from sidestore import SideStore #the cache is a small SQLite database next to the beets library
+from stats import STATS #counters of --stats
+
+
+DAY = 24 * 60 * 60 #in seconds
+ACCESSED = 1000 #hits whose access times are kept in memory at most, a process that never calls set() or close() loses no more of them
+
+
+class ResponseCache(SideStore): #persistent cache of the bodies of successful responses, keyed by the normalized request, shared by all libraries
+
+    def __init__(self, config, log):
+        self._log = log
+
+        config['cache'].add({ #default values, overridden by config.yaml
+            'enabled': True,
+            'path': '', #empty means metadata_retriever_cache.db in the beets configuration directory
+            'max_size': 256 * 1024 * 1024, #in bytes, least recently used responses are deleted above this size
+            'ttl': { #in seconds, for each endpoint
+                'search': 7 * DAY, #Genius /search results
+                'lyrics': 30 * DAY, #Genius song pages
+                'musicbrainz': 30 * DAY, #release groups used by allreleases
+            },
+        })
+
+        cache = config['cache']
+        self.enabled = cache['enabled'].get(bool) #--no-cache turns it off for a run
+        self.refresh = False #--refresh skips the lookups but still stores the new responses
+        self.max_size = cache['max_size'].get(int)
+        self.ttl = dict((endpoint, cache['ttl'][endpoint].as_number()) for endpoint in cache['ttl'].keys())
+
+        super(ResponseCache, self).__init__('cache', [
+            'PRAGMA journal_mode=WAL', #readers do not wait for the writer
+            'CREATE TABLE IF NOT EXISTS responses ('
+            'key TEXT PRIMARY KEY, endpoint TEXT, body TEXT, '
+            'size INTEGER, expires REAL, last_access REAL)',
+            'CREATE INDEX IF NOT EXISTS responses_access ON responses (last_access)',
+        ], cache['path'].as_filename() if cache['path'].get() else '')
+
+        self._size = 0 #total size of the stored bodies
+        self.accessed = {} #key -> time of the hits since the last commit, written by set(), evict() and close() instead of one commit per hit
+
+    def opened(self, db):
+        self._size = db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def key(self, endpoint, url, params=None): #the same request always gets the same key
+        scheme, netloc, path, query, fragment = urlsplit(url)
+        query = parse_qsl(query) + sorted((params or {}).items())
+        query = urlencode(sorted((k, ' '.join(str(v).lower().split())) for k, v in query)) #sorted parameters, lower case, single spaces
+        url = urlunsplit((scheme.lower(), netloc.lower(), path.rstrip('/'), query, '')) #the fragment never reaches the server
+        return hashlib.sha1((endpoint + ' ' + url).encode('utf-8')).hexdigest()
+
+    def get(self, endpoint, url, params=None): #returns the cached body or None
+        if (not self.enabled or self.refresh):
+            return None
+
+        key = self.key(endpoint, url, params)
+        now = time.time()
+
+        with self._lock:
+            db = self.connection()
+            row = db.execute('SELECT body, expires FROM responses WHERE key = ?', (key,)).fetchone()
+            if (not row):
+                STATS.count('cache_misses.' + endpoint)
+                return None
+            if (row[1] < now): #expired, it will be replaced by the next set()
+                STATS.count('cache_expired.' + endpoint)
+                return None
+            self.accessed[key] = now
+            if (len(self.accessed) >= ACCESSED):
+                self.touch(db)
+                db.commit()
+
+        STATS.count('cache_hits.' + endpoint)
+        return row[0]
+
+    def set(self, endpoint, url, body, params=None):
+        if (not self.enabled or body is None):
+            return
+
+        key = self.key(endpoint, url, params)
+        now = time.time()
+        size = len(body.encode('utf-8'))
+
+        with self._lock:
+            db = self.connection()
+            old = db.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+            db.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)',
+                (key, endpoint, body, size, now + self.ttl.get(endpoint, DAY), now)
+            )
+            self._size += size - (old[0] if old else 0)
+            self.accessed.pop(key, None)
+            self.touch(db) #committed with the response
+
+            if (self._size > self.max_size):
+                self.evict(db, now)
+
+            db.commit()
+
+    def touch(self, db): #the caller holds self._lock and commits
+        if (self.accessed):
+            db.executemany('UPDATE responses SET last_access = ? WHERE key = ?', [(when, key) for key, when in self.accessed.items()])
+            self.accessed.clear()
+
+    def evict(self, db, now): #expired responses go first, then the least recently used ones until 90% of the budget; set() has written the access times
+        db.execute('DELETE FROM responses WHERE expires < ?', (now,))
+        self._size = db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+        target = self.max_size * 0.9
+        if (self._size <= target):
+            return
+
+        removed = []
+        for key, size in db.execute('SELECT key, size FROM responses ORDER BY last_access'):
+            if (self._size <= target):
+                break
+            removed.append((key,))
+            self._size -= size
+
+        db.executemany('DELETE FROM responses WHERE key = ?', removed)
+        self._log.debug('cache: evicted {0} responses', len(removed))
+
+    def release(self): #the access times of the last hits are kept too
+        if (self._db is not None):
+            self.touch(self._db)
+        super(ResponseCache, self).release()
+
+    def get_json(self, endpoint, url, params=None):
+        body = self.get(endpoint, url, params)
+        if (body is None):
+            return None
+        return json.loads(body)
+
+    def set_json(self, endpoint, url, data, params=None):
+        self.set(endpoint, url, json.dumps(data), params)
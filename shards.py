@@ -0,0 +1,93 @@
+from beets import config as beets_config #to find the configuration directory of beets
+from beets.dbcore import query as dbquery #queries that SQLite evaluates
+
+import os #operating system support
+import time #the time a lock was taken
+import socket #the host that holds a lock, shards can run on several machines
+
+
+MULTIPLIER = 2654435761 #Knuth's multiplicative hash, consecutive ids are spread over the shards
+
+
+def parseshard(text): #"i/N" -> (i, N), i counts from 0
+    try:
+        index, count = [int(part) for part in text.split('/')]
+    except ValueError:
+        raise ValueError('--shard must look like 0/4, not {0}'.format(text))
+    if (count < 1 or not 0 <= index < count):
+        raise ValueError('--shard {0}: the shard must be between 0 and {1}'.format(text, max(0, count - 1)))
+    return index, count
+
+
+def shardof(key, count):
+    return ((key * MULTIPLIER) % 4294967296) % count
+
+
+class ShardQuery(dbquery.FieldQuery): #the rows of one shard; items are sharded by their album, so an album is never split
+
+    def __init__(self, model, index, count):
+        self.items = (model == 'item')
+        field = 'COALESCE(album_id, id)' if self.items else 'id'
+        super(ShardQuery, self).__init__(field, (index, count), True)
+
+    def col_clause(self):
+        return '(({0} * {1}) % 4294967296) % ? = ?'.format(self.field, MULTIPLIER), [self.pattern[1], self.pattern[0]]
+
+    def match(self, obj):
+        key = (obj.get('album_id') or obj.id) if self.items else obj.id
+        return shardof(key, self.pattern[1]) == self.pattern[0]
+
+
+class ShardLock(): #lock file of a shard, so two runs, on the same machine or on machines sharing the directory, never take the same shard
+
+    def __init__(self, config, log, index, count):
+        self._log = log
+
+        config.add({ #default values, overridden by config.yaml
+            'shard_locks': '', #directory of the lock files, empty means the beets configuration directory; a shared directory for several machines
+        })
+
+        directory = config['shard_locks'].as_filename() if config['shard_locks'].get() else beets_config.config_dir()
+        self.path = os.path.join(directory, 'metadata_retriever-shard-{0}-of-{1}.lock'.format(index, count))
+        self.owner = '{0} {1} {2}'.format(socket.gethostname(), os.getpid(), int(time.time()))
+
+    def acquire(self): #raises RuntimeError if another run holds the shard
+        for attempt in range(2):
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY) #atomic, also on most network file systems
+            except FileExistsError:
+                if (attempt == 0 and self.stale()):
+                    continue
+                raise RuntimeError('shard is taken by {0}, remove {1} if that run is gone'.format(self.holder(), self.path))
+            with os.fdopen(fd, 'w') as f:
+                f.write(self.owner + '\n')
+            return self
+
+    def holder(self):
+        try:
+            with open(self.path) as f:
+                return f.read().strip()
+        except IOError:
+            return ''
+
+    def stale(self): #a lock of this machine whose process is gone is taken over, locks of other machines are never guessed about
+        parts = self.holder().split()
+        if (len(parts) < 2 or parts[0] != socket.gethostname()):
+            return False
+        try:
+            os.kill(int(parts[1]), 0)
+            return False
+        except ProcessLookupError:
+            self._log.warning('removing the stale lock of process {0}: {1}', parts[1], self.path)
+            os.remove(self.path)
+            return True
+        except (ValueError, PermissionError): #PermissionError: the process exists
+            return False
+
+    def __enter__(self): #the lock is taken by acquire(), before the with statement
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if (self.holder() == self.owner):
+            os.remove(self.path)
+        return False
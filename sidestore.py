@@ -0,0 +1,62 @@
+from beets import config as beets_config #to find the configuration directory and the library of beets
+
+import os #operating system support
+import sqlite3 #each store is a small SQLite database next to the beets library
+import hashlib #the default file of a store of one library is named after the library
+import threading #the stores are shared by the threads of the plugin
+
+
+def librarykey(lib=None): #the database file of the library, the one of this beets run when lib is None
+    path = beets_config['library'].as_filename() if lib is None else lib.path
+    return path if isinstance(path, str) else path.decode('utf-8', 'replace')
+
+
+class SideStore(): #an SQLite database of the plugin, opened on first use; the subclasses run their statements holding self._lock
+
+    def __init__(self, name, schema, path='', library=False):
+        self.name = name
+        self.schema = schema #statements run each time the file is opened
+        self.configured = path #the path of the configuration, empty means metadata_retriever_<name>.db in the beets configuration directory
+        self.library = library #the rows are keyed by item or album ids, which only mean something in one library
+        self.path = self.filename(None)
+
+        self._lock = threading.Lock()
+        self._db = None #opened on first use, so commands that never use the store do not create the file
+
+    def filename(self, lib):
+        if (self.configured):
+            return self.configured
+        if (not self.library):
+            return os.path.join(beets_config.config_dir(), 'metadata_retriever_{0}.db'.format(self.name))
+
+        digest = hashlib.sha1(librarykey(lib).encode('utf-8')).hexdigest()[:12] #two libraries under one BEETSDIR never share the ids
+        return os.path.join(beets_config.config_dir(), 'metadata_retriever_{0}_{1}.db'.format(self.name, digest))
+
+    def bind(self, lib): #the library of the following calls, called by the plugin before it uses the store
+        path = self.filename(lib)
+        with self._lock:
+            if (path != self.path):
+                self.release()
+                self.path = path
+
+    def connection(self): #the caller holds self._lock
+        if (self._db is None):
+            self._db = sqlite3.connect(self.path, check_same_thread=False) #access is serialized by self._lock
+            for statement in self.schema:
+                self._db.execute(statement)
+            self._db.commit()
+            self.opened(self._db)
+        return self._db
+
+    def opened(self, db): #for the stores that read something from a newly opened file
+        pass
+
+    def release(self): #the caller holds self._lock; pending changes are committed
+        if (self._db is not None):
+            self._db.commit()
+            self._db.close()
+            self._db = None
+
+    def close(self):
+        with self._lock:
+            self.release()
@@ -0,0 +1,147 @@
+import time #timers
+import json #JavaScript Object Notation, one of the export formats
+import threading #counters are updated by the download threads
+import collections #counters
+
+
+class NullTimer(): #what timer() returns while the statistics are off, entering and leaving it costs nothing
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+class Timer():
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stats.addtime(self.name, time.perf_counter() - self.start)
+        return False
+
+
+NULL_TIMER = NullTimer()
+
+
+class Stats(): #counters and timers of a run, --stats turns them on
+
+    def __init__(self):
+        self.enabled = False #every method returns at once while this is False
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.counters = collections.Counter()
+            self.gauges = {} #name -> last value given to set()
+            self.timers = collections.OrderedDict() #name -> [calls, seconds]
+            self.started = time.time()
+
+    def count(self, name, n=1):
+        if (not self.enabled):
+            return
+        with self.lock:
+            self.counters[name] += n
+
+    def set(self, name, value): #for values that are read, not added up
+        if (not self.enabled):
+            return
+        with self.lock:
+            self.gauges[name] = value
+
+    def timer(self, name): #with STATS.timer('parse'): ...
+        if (not self.enabled):
+            return NULL_TIMER
+        return Timer(self, name)
+
+    def addtime(self, name, seconds):
+        if (not self.enabled):
+            return
+        with self.lock:
+            timer = self.timers.setdefault(name, [0, 0.0])
+            timer[0] += 1
+            timer[1] += seconds
+
+    def take(self): #what a worker process counted since the last take(), for merge() in the plugin process
+        with self.lock:
+            data = (dict(self.counters), dict(self.gauges), dict((name, tuple(timer)) for name, timer in self.timers.items()))
+            self.counters = collections.Counter()
+            self.gauges = {}
+            self.timers = collections.OrderedDict()
+        return data
+
+    def merge(self, data): #adds the numbers of take() in another process
+        if (not self.enabled or data is None):
+            return
+        counters, gauges, timers = data
+        with self.lock:
+            self.counters.update(counters)
+            self.gauges.update(gauges)
+            for name, (calls, seconds) in timers.items():
+                timer = self.timers.setdefault(name, [0, 0.0])
+                timer[0] += calls
+                timer[1] += seconds
+
+    def data(self):
+        with self.lock:
+            return {
+                'seconds': round(time.time() - self.started, 3),
+                'counters': dict(sorted(self.counters.items())),
+                'gauges': dict(sorted(self.gauges.items())),
+                'timers': dict((name, {'calls': calls, 'seconds': round(seconds, 4)}) for name, (calls, seconds) in sorted(self.timers.items())),
+            }
+
+    def report(self): #lines for the command line
+        data = self.data()
+        lines = ['run time: {0:.1f}s'.format(data['seconds'])]
+
+        for name, value in sorted(list(data['counters'].items()) + list(data['gauges'].items())):
+            lines.append('{0:<40} {1:>12}'.format(name, value))
+
+        for name, timer in data['timers'].items():
+            average = timer['seconds'] / timer['calls'] * 1000 if timer['calls'] else 0
+            lines.append('{0:<40} {1:>12.3f}s  {2:>8} calls  {3:>9.2f}ms each'.format(name, timer['seconds'], timer['calls'], average))
+
+        return lines
+
+    def json(self):
+        return json.dumps(self.data(), indent=2, sort_keys=True)
+
+    def prometheus(self): #text exposition format, names like requests.api.genius.com become labels
+        data = self.data()
+        families = collections.OrderedDict() #metric -> (type, samples), the samples of a metric follow its TYPE line
+
+        def add(name, kind, suffixes):
+            metric, label = (name.split('.', 1) + [''])[:2]
+            labels = '{{key="{0}"}}'.format(label) if label else ''
+            family = 'metadata_retriever_' + metric + {'counter': '_total', 'gauge': '', 'summary': '_seconds'}[kind]
+            samples = families.setdefault(family, (kind, []))[1]
+            for suffix, value in suffixes:
+                samples.append('{0}{1}{2} {3}'.format(family, suffix, labels, value))
+
+        for name, value in data['counters'].items():
+            add(name, 'counter', [('', value)])
+
+        for name, value in data['gauges'].items(): #set() values, they can go down, so no _total
+            add(name, 'gauge', [('', value)])
+
+        for name, timer in data['timers'].items():
+            add(name, 'summary', [('_sum', timer['seconds']), ('_count', timer['calls'])])
+
+        lines = []
+        for family, (kind, samples) in families.items():
+            lines.append('# TYPE {0} {1}'.format(family, kind))
+            lines.extend(samples)
+
+        return '\n'.join(lines) + '\n'
+
+
+STATS = Stats() #shared by all modules of the plugin
@@ -0,0 +1,47 @@
+#the incremental filters: SQLite finds the items whose lyrics were stored after the watermark, like match() does
+
+import os #operating system support
+import sys #the plugin modules are imported from the parent directory
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from beets import library
+
+from incremental import StampQuery, changedsince, LYRICS_STORED
+
+
+class StampTest(unittest.TestCase):
+
+    def setUp(self):
+        self.lib = library.Library(':memory:', '/music')
+        for number in range(4):
+            item = library.Item(path='/music/{0}.mp3'.format(number).encode('utf-8'), title=str(number))
+            self.lib.add(item)
+            item.added = item.mtime = 100.0 #add() sets added to now
+            item.store()
+
+        first, second = self.lib.items()[0], self.lib.items()[1]
+        first[LYRICS_STORED] = 500.0 #like storelyrics
+        first.store()
+        with self.lib.transaction() as tx: #like ingest
+            tx.mutate('INSERT INTO item_attributes (entity_id, key, value) VALUES (?, ?, ?)', (second.id, LYRICS_STORED, repr(300.0)))
+        self.first, self.second = first.id, second.id
+
+    def test_sql_agrees_with_match(self):
+        for watermark in (0.0, 200.0, 300.0, 400.0, 600.0):
+            with self.subTest(watermark=watermark):
+                query = StampQuery(LYRICS_STORED, watermark)
+                selected = set(item.id for item in self.lib.items(query))
+                self.assertEqual(selected, set(item.id for item in self.lib.items() if query.match(item)))
+
+    def test_changedsince(self):
+        query = changedsince(['added', 'mtime'], 400.0, [LYRICS_STORED])
+        self.assertEqual([item.id for item in self.lib.items(query)], [self.first])
+
+        query = changedsince(['added', 'mtime'], 400.0) #without the stamps storing lyrics changes nothing
+        self.assertEqual(list(self.lib.items(query)), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
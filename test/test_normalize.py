@@ -0,0 +1,50 @@
+#artist matching of the Genius hits: exact and alias matches first, fuzzy matching only when it is turned on
+
+import os #operating system support
+import sys #the plugin modules are imported from the parent directory
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from beets import config
+
+from normalize import ArtistMatcher, artistkey
+
+
+def matcher(**options):
+    config.read(user=False, defaults=True)
+    view = config['normalize_test_{0}'.format(len(options))]
+    view.set(options)
+    return ArtistMatcher(view)
+
+
+class MatchTest(unittest.TestCase):
+
+    def test_keys(self):
+        self.assertEqual(artistkey('The Beatles'), artistkey('Beatles'))
+        self.assertEqual(artistkey('Simon & Garfunkel'), artistkey('Simon and Garfunkel'))
+        self.assertEqual(artistkey('Drake feat. Rihanna'), artistkey('Drake'))
+        self.assertNotEqual(artistkey('The The'), artistkey('The'))
+
+    def test_fuzzy_is_off_by_default(self):
+        names = matcher()
+        for artist, hit in (('Drake', 'Drakeo'), ('Queen', 'Queens'), ('Future', 'Futures'), ('The Weeknd', 'The Weekend')):
+            self.assertFalse(names.match(artist, hit), hit)
+
+    def test_fuzzy_never_takes_longer_names(self):
+        names = matcher(fuzzy_match=0.8)
+        self.assertFalse(names.match('Drake', 'Drakeo'))
+        self.assertFalse(names.match('Queen', 'Queens'))
+        self.assertFalse(names.match('Blink-182', 'Blink-183'))
+        self.assertTrue(names.match('The Weeknd', 'The Weekend'))
+
+    def test_exact_hit_beats_earlier_fuzzy_and_alias(self):
+        names = matcher(fuzzy_match=0.8, artist_aliases={'Prince': ['The Artist']})
+        hits = ['The Prinze', 'The Artist', 'Prince']
+        self.assertEqual(names.best('Prince', hits, lambda hit: hit), 'Prince')
+        self.assertEqual(names.best('Prince', hits[:2], lambda hit: hit), 'The Artist')
+        self.assertIsNone(names.best('Prince', ['Madonna'], lambda hit: hit))
+
+
+if __name__ == '__main__':
+    unittest.main()
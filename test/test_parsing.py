@@ -0,0 +1,60 @@
+#the fast lyrics parser has to give the text of the full parser for every page it accepts
+
+import os #operating system support
+import sys #the plugin modules are imported from the parent directory
+import glob #fixture pages
+import logging #Genius needs a logger
+import unittest
+from string import Template #the fixtures have $title and $artist placeholders
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from beets import config
+
+FIXTURES = os.path.join(ROOT, 'benchmarks', 'fixtures')
+SEPARATORS = ['\r', '\r\n', '\x0b', '\x0c', '\x1c', '\x1d', '\x1e', '\x85', '\u2028', '\u2029'] #str.splitlines() ends lines at these, HTMLParser only at \n
+
+
+class ParserTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        config.read(user=False, defaults=True)
+        config['metadata_retriever']['genius_api_key'] = 'test'
+
+        import getlyrics
+        cls.genius = getlyrics.Genius(config['metadata_retriever'], logging.getLogger('test'))
+
+    def page(self, name):
+        with open(os.path.join(FIXTURES, name), encoding='utf-8', newline='') as f:
+            return Template(f.read()).safe_substitute(title='Song Title', artist='Artist Name')
+
+    def assertSameLyrics(self, page):
+        full = self.genius.parselyrics(page)
+        fast = self.genius.fastlyrics(page)
+        if (fast is not None): #None means the full parser decides
+            self.assertEqual(fast, full)
+        self.assertEqual(self.genius.scrapelyrics(page), full)
+
+    def test_fixtures(self):
+        for path in sorted(glob.glob(os.path.join(FIXTURES, '*.html'))):
+            with self.subTest(page=os.path.basename(path)):
+                self.assertSameLyrics(self.page(os.path.basename(path)))
+
+    def test_song_page_takes_fast_path(self):
+        self.assertIsNotNone(self.genius.fastlyrics(self.page('genius_song.html')))
+
+    def test_separators_before_lyrics(self):
+        for separator in SEPARATORS:
+            page = ('<html><head><script>var s = "a{0}b";</script></head><body>\n'
+                    'Plain text{0}before the lyrics\n'
+                    '<div id="root"><div class="Lyrics__Container-sc-1">Hello<br/>World, a{0}longer line</div></div>\n'
+                    '<p>after</p></body></html>\n').format(separator)
+            with self.subTest(separator=repr(separator)):
+                self.assertIsNotNone(self.genius.fastlyrics(page))
+                self.assertSameLyrics(page)
+
+
+if __name__ == '__main__':
+    unittest.main()
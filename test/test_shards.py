@@ -0,0 +1,62 @@
+#ShardQuery runs as SQL in SQLite and as match() in Python, both have to agree with shardof
+
+import os #operating system support
+import sys #the plugin modules are imported from the parent directory
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from beets import library
+
+from shards import ShardQuery, shardof, parseshard
+
+
+class ShardTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.lib = library.Library(':memory:', '/music')
+        for a in range(40):
+            cls.lib.add_album([library.Item(path='/music/{0}/{1}.mp3'.format(a, t).encode('utf-8'), title='t', album='a{0}'.format(a)) for t in range(3)])
+        for s in range(25): #singletons have no album_id, they are sharded by their own id
+            cls.lib.add(library.Item(path='/music/single/{0}.mp3'.format(s).encode('utf-8'), title='s'))
+
+    def test_sql_agrees_with_shardof(self):
+        for count in (1, 2, 3, 4, 7):
+            for index in range(count):
+                with self.subTest(shard='{0}/{1}'.format(index, count)):
+                    albums = set(album.id for album in self.lib.albums(ShardQuery('album', index, count)))
+                    self.assertEqual(albums, set(album.id for album in self.lib.albums() if shardof(album.id, count) == index))
+
+                    items = set(item.id for item in self.lib.items(ShardQuery('item', index, count)))
+                    self.assertEqual(items, set(item.id for item in self.lib.items() if shardof(item.album_id or item.id, count) == index))
+
+    def test_match_agrees_with_sql(self):
+        query = ShardQuery('item', 1, 3)
+        selected = set(item.id for item in self.lib.items(query))
+        self.assertEqual(selected, set(item.id for item in self.lib.items() if query.match(item)))
+
+    def test_shards_cover_everything_once(self):
+        seen = []
+        for index in range(4):
+            seen.extend(item.id for item in self.lib.items(ShardQuery('item', index, 4)))
+        self.assertEqual(sorted(seen), sorted(item.id for item in self.lib.items()))
+
+    def test_album_is_not_split(self):
+        for album in self.lib.albums():
+            self.assertEqual(len(set(shardof(item.album_id, 4) for item in album.items())), 1)
+
+    def test_large_ids(self): #the product has to stay inside the 64-bit integers of SQLite
+        for key in (1, 2 ** 31 - 1, 2 ** 32, 10 ** 9 + 7):
+            row = self.lib._connection().execute('SELECT ((? * 2654435761) % 4294967296) % 5', (key,)).fetchone()
+            self.assertEqual(row[0], shardof(key, 5))
+
+    def test_parseshard(self):
+        self.assertEqual(parseshard('2/4'), (2, 4))
+        for text in ('4/4', '-1/4', '1/0', 'a/b', '1'):
+            with self.assertRaises(ValueError):
+                parseshard(text)
+
+
+if __name__ == '__main__':
+    unittest.main()
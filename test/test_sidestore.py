@@ -0,0 +1,88 @@
+#the stores keyed by item ids keep one file for each library, the ones keyed by urls and paths are shared
+
+import os #operating system support
+import sys #the plugin modules are imported from the parent directory
+import shutil
+import logging
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from beets import config, library
+
+from lyricsindex import LyricsIndex
+from responsecache import ResponseCache
+
+
+class SideStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        os.environ['BEETSDIR'] = self.directory #the configuration directory of the default files
+        self.addCleanup(os.environ.pop, 'BEETSDIR')
+        config.clear() #the paths set by the other tests
+        config.read(user=False, defaults=True)
+        self.view = config['sidestore_test']
+
+    def library(self, name): #a library with one song, item id 1
+        lib = library.Library(os.path.join(self.directory, name), self.directory)
+        lib.add(library.Item(path=os.path.join(self.directory, name + '.mp3').encode('utf-8'), title=name, artist='a', lyrics=name + ' words'))
+        return lib
+
+    def test_index_is_separated_per_library(self):
+        first, second = self.library('first.db'), self.library('second.db')
+        index = LyricsIndex(self.view, logging.getLogger('test'))
+        self.addCleanup(index.close)
+
+        index.bind(first)
+        index.update(first.get_item(1))
+        index.flush()
+        path = index.path
+
+        index.bind(second)
+        self.assertNotEqual(index.path, path)
+        self.assertEqual(index.search('first'), []) #the same item id in another library
+        index.update(second.get_item(1))
+        index.flush()
+
+        index.bind(first)
+        self.assertEqual([row[2] for row in index.search('words')], ['first.db'])
+        self.assertFalse(index.empty())
+
+        index.bind(self.library('third.db'))
+        self.assertTrue(index.empty())
+
+    def test_configured_path_is_kept(self):
+        self.view['search']['path'] = os.path.join(self.directory, 'index.db')
+        index = LyricsIndex(self.view, logging.getLogger('test'))
+        index.bind(self.library('first.db'))
+        self.assertEqual(index.path, os.path.join(self.directory, 'index.db'))
+
+    def test_cache_is_shared(self):
+        cache = ResponseCache(self.view, logging.getLogger('test'))
+        self.addCleanup(cache.close)
+        cache.bind(self.library('first.db'))
+        self.assertEqual(os.path.basename(cache.path), 'metadata_retriever_cache.db')
+
+    def test_cache_hits_are_written_on_close(self): #a hit does not commit, its access time is written later
+        cache = ResponseCache(self.view, logging.getLogger('test'))
+        cache.set('search', 'https://example.org/search', 'body')
+        with cache._lock:
+            cache._db.execute('UPDATE responses SET last_access = 0')
+            cache._db.commit()
+
+        changes = cache._db.total_changes
+        self.assertEqual(cache.get('search', 'https://example.org/search'), 'body')
+        self.assertEqual(cache._db.total_changes, changes)
+
+        cache.close()
+        cache = ResponseCache(self.view, logging.getLogger('test'))
+        self.addCleanup(cache.close)
+        with cache._lock:
+            self.assertGreater(cache.connection().execute('SELECT last_access FROM responses').fetchone()[0], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
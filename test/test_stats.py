@@ -0,0 +1,52 @@
+#the Prometheus export: a TYPE line for each metric, counters end in _total, the values of set() do not
+
+import os #operating system support
+import sys #the plugin modules are imported from the parent directory
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stats import Stats
+
+
+class PrometheusTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stats = Stats()
+        self.stats.enabled = True
+
+    def test_types(self):
+        self.stats.count('requests.api.genius.com', 3)
+        self.stats.set('connections.api.genius.com', 2)
+        self.stats.addtime('stage.lyrics', 1.5)
+
+        lines = self.stats.prometheus().splitlines()
+        self.assertEqual(lines, [
+            '# TYPE metadata_retriever_requests_total counter',
+            'metadata_retriever_requests_total{key="api.genius.com"} 3',
+            '# TYPE metadata_retriever_connections gauge',
+            'metadata_retriever_connections{key="api.genius.com"} 2',
+            '# TYPE metadata_retriever_stage_seconds summary',
+            'metadata_retriever_stage_seconds_sum{key="lyrics"} 1.5',
+            'metadata_retriever_stage_seconds_count{key="lyrics"} 1',
+        ])
+
+    def test_one_type_line_per_metric(self):
+        for host in ('a.org', 'b.org'):
+            self.stats.count('requests.' + host)
+            self.stats.set('connections.' + host, 1)
+
+        lines = self.stats.prometheus().splitlines()
+        types = [line for line in lines if line.startswith('# TYPE')]
+        self.assertEqual(len(types), 2)
+        self.assertEqual(lines.index('# TYPE metadata_retriever_connections gauge'), 3) #the samples of one metric stay together
+
+    def test_set_replaces(self):
+        self.stats.set('connections.a.org', 4)
+        self.stats.set('connections.a.org', 1)
+        self.assertEqual(self.stats.data()['gauges'], {'connections.a.org': 1})
+        self.assertEqual(self.stats.data()['counters'], {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+#circuit breaker of HostThrottle: open, cooldown, one trial request, and what each answer of the trial does
+
+import os #operating system support
+import sys #the plugin modules are imported from the parent directory
+import time
+import logging
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from beets import config
+
+from throttle import HostThrottle, HostUnavailable, Throttle
+
+
+def opened(cooldown=0.05): #a host whose circuit has just opened
+    throttle = HostThrottle('example.org', rate=1000.0, burst=1000.0, min_rate=1.0, max_rate=1000.0, threshold=2, cooldown=cooldown)
+    throttle.failure()
+    throttle.failure()
+    return throttle
+
+
+class CircuitTest(unittest.TestCase):
+
+    def trial(self, throttle): #waits for the cooldown and starts the trial request
+        time.sleep(throttle.cooldown + 0.01)
+        throttle.acquire()
+        self.assertTrue(throttle.trial)
+
+    def test_open_rejects_until_cooldown(self):
+        throttle = opened()
+        with self.assertRaises(HostUnavailable):
+            throttle.acquire()
+        self.trial(throttle)
+        with self.assertRaisesRegex(HostUnavailable, 'trial'): #one request at a time tests the host
+            throttle.acquire()
+
+    def test_trial_success_closes(self):
+        throttle = opened()
+        self.trial(throttle)
+        throttle.success()
+        throttle.acquire()
+        self.assertIsNone(throttle.opened)
+
+    def test_trial_failure_reopens(self):
+        throttle = opened()
+        self.trial(throttle)
+        throttle.failure()
+        self.assertFalse(throttle.trial)
+        with self.assertRaisesRegex(HostUnavailable, 'skipped for'):
+            throttle.acquire()
+
+    def test_trial_429_closes(self): #the host answered, it is only busy
+        throttle = opened()
+        self.trial(throttle)
+        throttle.throttled(None)
+        self.assertFalse(throttle.trial)
+        throttle.acquire() #never "skipped for -0s" for the rest of the run
+
+    def test_trial_503_reopens(self): #HTTPSession.get calls throttled() and failure() for a 503
+        throttle = opened()
+        self.trial(throttle)
+        throttle.throttled(None)
+        throttle.failure()
+        with self.assertRaises(HostUnavailable):
+            throttle.acquire()
+
+    def test_call_non_retryable_error_ends_trial(self):
+        config.read(user=False, defaults=True)
+        view = config['throttle_test']
+        view['throttle']['failures'] = 2
+        view['throttle']['cooldown'] = 0.05
+        view['throttle']['retries'] = 0
+        throttles = Throttle(view, logging.getLogger('test'))
+        throttle = throttles.host('example.org')
+        throttle.failure()
+        throttle.failure()
+        time.sleep(0.06)
+
+        def notfound():
+            raise KeyError('404')
+
+        with self.assertRaises(KeyError):
+            throttles.call('example.org', notfound, lambda exc: (False, None))
+        self.assertFalse(throttle.trial)
+        self.assertEqual(throttles.call('example.org', lambda: 'answer', lambda exc: (False, None)), 'answer')
+
+
+if __name__ == '__main__':
+    unittest.main()
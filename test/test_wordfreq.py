@@ -0,0 +1,55 @@
+#the totals of WordCounts follow changed lyrics, and the counts are committed in batches
+
+import os #operating system support
+import sys #the plugin modules are imported from the parent directory
+import shutil
+import logging
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from beets import config, library
+
+from wordfreq import WordCounts
+
+
+class WordCountsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        config.clear()
+        config.read(user=False, defaults=True)
+        view = config['wordfreq_test']
+        view['wordclouds']['path'] = os.path.join(self.directory, 'words.db')
+        view['wordclouds']['batch'] = 3
+        self.words = WordCounts(view, logging.getLogger('test'))
+        self.addCleanup(self.words.close)
+
+    def item(self, item_id, lyrics):
+        return library.Item(id=item_id, artist='Artist', album='Album', lyrics=lyrics)
+
+    def test_changed_lyrics_replace_their_words(self):
+        self.words.update(self.item(1, 'river river mountain'))
+        self.words.update(self.item(2, 'river ocean'))
+        self.words.update(self.item(1, 'desert desert'))
+
+        self.assertEqual(self.words.frequencies('artist', 'Artist'), {'river': 1, 'ocean': 1, 'desert': 2})
+        self.assertEqual(self.words.frequencies('album', 'Artist - Album'), {'river': 1, 'ocean': 1, 'desert': 2})
+
+    def test_commits_in_batches(self):
+        self.words.update(self.item(1, 'river'))
+        self.words.update(self.item(2, 'ocean'))
+        self.assertTrue(self.words._db.in_transaction)
+
+        self.words.update(self.item(3, 'desert')) #the third song of the batch
+        self.assertFalse(self.words._db.in_transaction)
+
+        self.words.update(self.item(4, 'forest'))
+        self.words.flush()
+        self.assertFalse(self.words._db.in_transaction)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,171 @@
+import time #token buckets refill with time
+import random #jitter of the backoff
+import threading #hosts are shared by the download threads
+import email.utils #Retry-After can be an HTTP date
+
+import requests #HostUnavailable is a RequestException, so every caller that survives network errors survives it too
+
+from stats import STATS #counters of --stats
+
+
+class HostUnavailable(requests.ConnectionError): #raised without a request while the circuit of a host is open
+    pass
+
+
+def retryafter(value): #seconds to wait from a Retry-After header, None if there is none
+    if (not value):
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+class HostThrottle(): #token bucket and circuit breaker of one host
+
+    def __init__(self, host, rate, burst, min_rate, max_rate, threshold, cooldown):
+        self.host = host
+        self.rate = rate #requests per second, adapted: halved on 429 and 503, slowly raised on success
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.threshold = threshold #failures in a row that open the circuit
+        self.cooldown = cooldown #seconds the circuit stays open before one trial request
+
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused = 0.0 #no request before this time, set by Retry-After
+        self.failures = 0
+        self.opened = None #time the circuit was opened, None while it is closed
+        self.trial = False #a request is testing the host after the cooldown
+        self.lock = threading.Lock()
+
+    def acquire(self): #waits for a token; raises HostUnavailable while the circuit is open
+        while (True):
+            with self.lock:
+                now = time.monotonic()
+
+                if (self.opened is not None):
+                    if (now - self.opened < self.cooldown or self.trial):
+                        STATS.count('circuit_rejected.' + self.host)
+                        if (self.trial):
+                            raise HostUnavailable('{0} is not answering, a trial request is testing it'.format(self.host))
+                        raise HostUnavailable('{0} is not answering, skipped for {1:.0f}s'.format(self.host, self.cooldown - (now - self.opened)))
+                    self.trial = True #half open: this request decides
+
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                wait = max(self.paused - now, (1.0 - self.tokens) / self.rate if self.tokens < 1.0 else 0.0)
+                if (wait <= 0):
+                    self.tokens -= 1.0
+                    return
+
+            STATS.addtime('throttled.' + self.host, wait)
+            time.sleep(wait)
+
+    def success(self):
+        with self.lock:
+            self.close()
+            self.rate = min(self.max_rate, self.rate + 0.1 * self.min_rate) #additive increase
+
+    def answered(self): #an error of the request itself, like a 404: the host is up
+        with self.lock:
+            self.close()
+
+    def close(self): #the caller holds the lock; every answer of the host ends the trial and closes the circuit
+        self.failures = 0
+        self.opened = None
+        self.trial = False
+
+    def throttled(self, delay): #429 or 503, the server asks for less
+        with self.lock:
+            if (self.trial): #the trial got an answer, the host is up but busy: the pause and the lower rate slow it down, a 503 reopens the circuit in failure()
+                self.trial = False
+                self.opened = None
+            self.rate = max(self.min_rate, self.rate / 2.0) #multiplicative decrease
+            if (delay):
+                self.paused = max(self.paused, time.monotonic() + delay)
+            self.tokens = min(self.tokens, 0.0)
+        STATS.count('throttled.' + self.host)
+
+    def failure(self): #a connection error or a server error
+        with self.lock:
+            self.failures += 1
+            if (self.trial or self.failures >= self.threshold):
+                if (self.opened is None or self.trial):
+                    STATS.count('circuit_opened.' + self.host)
+                self.opened = time.monotonic()
+            self.trial = False
+
+
+class Throttle(): #the HostThrottle of each host and the retry policy
+
+    def __init__(self, config, log):
+        self._log = log
+
+        config['throttle'].add({ #default values, overridden by config.yaml
+            'rate': 5.0, #requests per second a host starts with
+            'burst': 5, #requests that can go at once after a quiet time
+            'min_rate': 0.2,
+            'max_rate': 20.0,
+            'retries': 3, #retries of a failed GET
+            'backoff': 0.5, #seconds, doubled on each retry, a random part of it is waited
+            'max_backoff': 30.0,
+            'failures': 5, #failures in a row that open the circuit of a host
+            'cooldown': 60.0, #seconds a host with an open circuit is skipped
+            'hosts': { #hosts with their own limits, the rest use the values above
+                'musicbrainz.org': {'rate': 1.0, 'burst': 1, 'max_rate': 1.0}, #https://musicbrainz.org/doc/MusicBrainz_API/Rate_Limiting
+            },
+        })
+
+        self.config = config['throttle']
+        self.retries = max(0, self.config['retries'].get(int))
+        self.backoff = self.config['backoff'].as_number()
+        self.max_backoff = self.config['max_backoff'].as_number()
+
+        self.hosts = {}
+        self.lock = threading.Lock()
+
+    def host(self, host):
+        with self.lock:
+            if (host not in self.hosts):
+                options = dict((key, self.config[key].get()) for key in ('rate', 'burst', 'min_rate', 'max_rate', 'failures', 'cooldown'))
+                name = host.split(':')[0]
+                for pattern, values in (self.config['hosts'].get(dict) or {}).items(): #musicbrainz.org also covers beta.musicbrainz.org
+                    if (name == pattern or name.endswith('.' + pattern)):
+                        options.update(values)
+                self.hosts[host] = HostThrottle(host, float(options['rate']), float(options['burst']), float(options['min_rate']),
+                                                float(options['max_rate']), int(options['failures']), float(options['cooldown']))
+            return self.hosts[host]
+
+    def delay(self, attempt): #full jitter, so threads that failed together do not retry together
+        return random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+
+    def call(self, host, function, retryable): #runs function() under the limits of host; retryable(exc) returns (retry, Retry-After seconds)
+        throttle = self.host(host)
+
+        for attempt in range(self.retries + 1):
+            throttle.acquire()
+            try:
+                result = function()
+            except Exception as exc:
+                retry, delay = retryable(exc)
+                if (delay is not None):
+                    throttle.throttled(delay)
+                elif (retry):
+                    throttle.failure()
+                else: #not worth a retry, but the host answered; a trial request is over either way
+                    throttle.answered()
+                if (not retry or attempt == self.retries):
+                    raise
+                STATS.count('retries.' + host)
+                time.sleep(max(delay or 0, self.delay(attempt)))
+                continue
+
+            throttle.success()
+            return result
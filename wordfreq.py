@@ -0,0 +1,115 @@
+import os #operating system support
+import re #regular expressions
+import json #the counts of each song are kept as JSON
+import hashlib #changed lyrics are found by their hash
+
+from sidestore import SideStore #the counts survive between runs, so they are kept in a small SQLite database
+from stats import STATS #counters of --stats
+
+
+TURKISH = str.maketrans({'İ': 'I', 'Ş': 'S', 'Ç': 'C', 'Ö': 'O'}) #converted Turkish characters to English for a better visual
+
+
+class WordCounts(SideStore): #word frequencies of each artist and album, updated only from new or changed lyrics, one for each library
+
+    def __init__(self, config, log):
+        self._log = log
+
+        config['wordclouds'].add({ #default values, overridden by config.yaml
+            'path': '', #empty means metadata_retriever_words_<library>.db in the beets configuration directory
+            'width': 1000,
+            'height': 500,
+            'albums': True, #a cloud for each album next to the one of each artist
+            'batch': 500, #songs whose counts are committed in one transaction
+        })
+
+        wordclouds = config['wordclouds']
+        self.width = wordclouds['width'].get(int)
+        self.height = wordclouds['height'].get(int)
+        self.albums = wordclouds['albums'].get(bool)
+        self.batch = max(1, wordclouds['batch'].get(int))
+        super(WordCounts, self).__init__('words', [
+            'CREATE TABLE IF NOT EXISTS songs (item_id INTEGER PRIMARY KEY, artist TEXT, album TEXT, digest TEXT, counts TEXT)',
+            'CREATE TABLE IF NOT EXISTS totals (kind TEXT, name TEXT, word TEXT, count INTEGER, PRIMARY KEY (kind, name, word))',
+        ], wordclouds['path'].as_filename() if wordclouds['path'].get() else '', library=True)
+
+        self.dirty = set() #(kind, name) of the clouds to render, kind is 'artist' or 'album'
+        self.tokenizer = None #a WordCloud that is only used for process_text, made on first use
+        self.uncommitted = 0 #songs counted since the last commit, pending() is the list of clouds
+
+    def count(self, lyrics): #the words WordCloud.generate would draw, with their counts
+        if (self.tokenizer is None):
+            from wordcloud import WordCloud
+            self.tokenizer = WordCloud()
+        return self.tokenizer.process_text(lyrics.translate(TURKISH).lower())
+
+    def update(self, item): #adds the words of the song to its artist and album, the words of its earlier lyrics are taken away first
+        artist = item.albumartist or item.artist
+        album = '{0} - {1}'.format(artist, item.album)
+        digest = hashlib.sha1(item.lyrics.encode('utf-8')).hexdigest()
+
+        with self._lock:
+            db = self.connection()
+            row = db.execute('SELECT artist, album, digest, counts FROM songs WHERE item_id = ?', (item.id,)).fetchone()
+            if (row and tuple(row[:3]) == (artist, album, digest)): #nothing changed since the last run
+                STATS.count('wordclouds.unchanged')
+                return
+
+        counts = self.count(item.lyrics) #outside the lock, it is the slow part
+
+        with self._lock:
+            db = self.connection()
+            if (row):
+                self.add(db, row[0], row[1], json.loads(row[3]), -1)
+            self.add(db, artist, album, counts, 1)
+            db.execute('INSERT OR REPLACE INTO songs VALUES (?, ?, ?, ?, ?)', (item.id, artist, album, digest, json.dumps(counts)))
+
+            self.uncommitted += 1
+            if (self.uncommitted >= self.batch):
+                self.commit(db)
+
+        STATS.count('wordclouds.updated')
+
+    def add(self, db, artist, album, counts, sign): #sign is 1 or -1
+        targets = [('artist', artist)] + ([('album', album)] if self.albums else [])
+
+        for kind, name in targets:
+            db.executemany('INSERT OR IGNORE INTO totals VALUES (?, ?, ?, 0)', [(kind, name, word) for word in counts])
+            db.executemany('UPDATE totals SET count = count + ? WHERE kind = ? AND name = ? AND word = ?',
+                           [(sign * n, kind, name, word) for word, n in counts.items()])
+            self.dirty.add((kind, name))
+
+            if (sign < 0): #only the words just taken away can drop to 0, each is found by the primary key
+                db.executemany('DELETE FROM totals WHERE kind = ? AND name = ? AND word = ? AND count <= 0', [(kind, name, word) for word in counts])
+
+    def commit(self, db):
+        db.commit()
+        self.uncommitted = 0
+
+    def flush(self): #called at the end of batch(), the counts are committed with the last batch of the library
+        with self._lock:
+            if (self._db is not None and self.uncommitted):
+                self.commit(self._db)
+
+    def frequencies(self, kind, name):
+        with self._lock:
+            rows = self.connection().execute('SELECT word, count FROM totals WHERE kind = ? AND name = ?', (kind, name))
+            return dict(rows.fetchall())
+
+    def pending(self): #the clouds changed in this run, each is rendered once
+        dirty, self.dirty = self.dirty, set()
+        return sorted(dirty)
+
+
+def render(frequencies, path, width, height): #runs in a worker process of the plugin
+    from wordcloud import WordCloud
+
+    temporary = path + '.part.png' #to_file finds the format from the extension
+    WordCloud(width=width, height=height).generate_from_frequencies(frequencies).to_file(temporary)
+    os.replace(temporary, path)
+
+    return path
+
+
+def filename(name): #artist and album names can contain the path separator
+    return re.sub(r'[\\/]', '_', name) + '.png'
@@ -0,0 +1,40 @@
+import time #the time an album was queued
+
+from sidestore import SideStore #the queue survives between runs, so it is kept in a small SQLite database
+
+
+class WorkQueue(SideStore): #persistent queue of album ids whose cover art and lyrics are fetched later, one for each library
+
+    def __init__(self, config, log):
+        self._log = log
+
+        config['queue'].add({ #default values, overridden by config.yaml
+            'path': '', #empty means metadata_retriever_queue_<library>.db in the beets configuration directory
+            'batch': 50, #albums taken from the queue at a time
+        })
+
+        self.batch = max(1, config['queue']['batch'].get(int))
+        super(WorkQueue, self).__init__('queue', [
+            'CREATE TABLE IF NOT EXISTS albums (album_id INTEGER PRIMARY KEY, queued REAL)',
+        ], config['queue']['path'].as_filename() if config['queue']['path'].get() else '', library=True)
+
+    def put(self, album_id): #queueing the same album twice keeps one entry
+        with self._lock:
+            db = self.connection()
+            db.execute('INSERT OR IGNORE INTO albums VALUES (?, ?)', (album_id, time.time()))
+            db.commit()
+
+    def peek(self): #the oldest batch of album ids, they stay in the queue until done() so an interrupted run loses nothing
+        with self._lock:
+            rows = self.connection().execute('SELECT album_id FROM albums ORDER BY queued LIMIT ?', (self.batch,))
+            return [row[0] for row in rows]
+
+    def done(self, album_ids):
+        with self._lock:
+            db = self.connection()
+            db.executemany('DELETE FROM albums WHERE album_id = ?', [(album_id,) for album_id in album_ids])
+            db.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self.connection().execute('SELECT COUNT(*) FROM albums').fetchone()[0]